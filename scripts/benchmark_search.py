@@ -0,0 +1,39 @@
+"""Benchmark search over the Pycolore playlist.
+
+Usage: python scripts/benchmark_search.py [NUMBER_OF_SONGS]
+
+Build a search index of NUMBER_OF_SONGS songs (default: 50000) and time
+typical autocompletion queries, first run (prefixes not merged yet) and
+following runs.
+"""
+import os
+import sys
+import time
+import timeit
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sunflower.utils.search import SearchIndex
+
+QUERIES = ("artist 42", "song 4999", "libr", "album 9", "s", "a")
+
+
+def benchmark(number_of_songs: int, repeat: int = 100):
+    songs = [
+        {"artist": f"Artist {i % 5000}", "title": f"Song {i} of the library", "album": f"Album {i % 10000}"}
+        for i in range(number_of_songs)]
+    start = time.perf_counter()
+    index = SearchIndex.build(songs)
+    print(f"build: {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{'query':<12}{'results':>8}{'first (µs)':>12}{'next (µs)':>12}")
+    for query in QUERIES:
+        start = time.perf_counter()
+        results = index.search(query)
+        first = time.perf_counter() - start
+        following = timeit.timeit(lambda: index.search(query), number=repeat) / repeat
+        print(f"{query:<12}{len(results):>8}{first * 1e6:>12.0f}{following * 1e6:>12.0f}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,110 @@
+"""Benchmark serializers of persisted values.
+
+Usage: python scripts/benchmark_serializers.py [--from-repository] [NUMBER_OF_SONGS]
+
+Encode and decode the values persisted by the scheduler: a step (current
+broadcast), a day schedule and the Pycolore playlist (NUMBER_OF_SONGS songs,
+default: 3000). Serializers whose library is not installed are skipped.
+
+With --from-repository, the documents are the ones persisted by the scheduler
+in the repository of conf.edn (current step and schedule of the first channel
+having them, and the Pycolore playlist); missing ones are generated.
+"""
+import argparse
+import os
+import sys
+import timeit
+from typing import Any
+from typing import Dict
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import edn_format
+from sunflower.core.config import K
+from sunflower.core.custom_types import Broadcast
+from sunflower.core.custom_types import BroadcastType
+from sunflower.core.custom_types import SongPayload
+from sunflower.core.custom_types import StationInfo
+from sunflower.core.custom_types import Step
+from sunflower.core.persistence import MetadataEncoder
+from sunflower.core.repository import repository_from_config
+from sunflower.core.serializers import SERIALIZERS
+from sunflower.core.serializers import loads
+
+
+def make_step(start: int) -> Step:
+    return Step(
+        start=start,
+        end=start + 240,
+        broadcast=Broadcast(
+            title="Nina Simone • Feeling Good",
+            link="https://www.deezer.com/track/1234567",
+            thumbnail_src="https://e-cdns-images.dzcdn.net/images/cover/1234567/500x500.jpg",
+            station=StationInfo(name="Radio Pycolore", website="https://radio.pycolore.fr"),
+            type=BroadcastType.MUSIC,
+            show_link="https://radio.pycolore.fr/pages/playlist-pycolore",
+            show_title="La playlist Pycolore",
+            summary="Une sélection aléatoire de chansons parmi les musiques stockées sur Pycolore. "
+                    "À suivre : Miles Davis, Ella Fitzgerald et Chet Baker.",
+            metadata=SongPayload(title="Feeling Good", artist="Nina Simone", album="La Playlist Pycolore")))
+
+
+def make_payloads(number_of_songs: int):
+    step = make_step(1600000000).dict()
+    schedule = [make_step(1600000000 + i * 240).dict() for i in range(360)]
+    # public fields of songs, as persisted by PycolorePlaylistStation
+    playlist = [
+        {"artist": f"Artiste {i % 300}", "title": f"Chanson numéro {i}", "album": f"Album n°{i % 700}"}
+        for i in range(number_of_songs)]
+    return {"step": step, "schedule": schedule, "playlist": playlist}
+
+
+def payloads_from_repository(config: Dict) -> Dict[str, Any]:
+    """Return documents persisted by the scheduler in the repository of config (see module docstring)."""
+    repository = repository_from_config(config)
+    payloads = {}
+    for channel in config[K("channels")]:
+        current_step, schedule = repository.retrieve_many([
+            f"sunflower:channel:{channel[K('id')]}:current", f"sunflower:channel:{channel[K('id')]}:schedule"])
+        if current_step is not None:
+            payloads.setdefault("step", current_step)
+        if schedule:
+            payloads.setdefault("schedule", schedule)
+    playlist = repository.retrieve("sunflower:station:pycolore:playlist")
+    if playlist:
+        payloads["playlist"] = playlist
+    return payloads
+
+
+def benchmark(payloads: Dict[str, Any], repeat: int = 5):
+    print(f"{'payload':<10}{'serializer':<12}{'size (B)':>10}{'encode (µs)':>14}{'decode (µs)':>14}")
+    for payload_name, payload in payloads.items():
+        number = max(1, 1000000 // len(str(payload)))
+        for serializer_name, serializer_cls in SERIALIZERS.items():
+            try:
+                serializer = serializer_cls()
+            except RuntimeError:
+                continue
+            data = serializer.dumps(payload, MetadataEncoder)
+            encode_time = min(timeit.repeat(
+                lambda: serializer.dumps(payload, MetadataEncoder), number=number, repeat=repeat)) / number
+            decode_time = min(timeit.repeat(lambda: loads(data), number=number, repeat=repeat)) / number
+            print(f"{payload_name:<10}{serializer_name:<12}{len(data):>10}"
+                  f"{encode_time * 1e6:>14.1f}{decode_time * 1e6:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--from-repository", action="store_true", help="use documents persisted by the scheduler")
+    parser.add_argument("number_of_songs", type=int, nargs="?", default=3000, help="default: 3000")
+    args = parser.parse_args()
+    payloads = make_payloads(args.number_of_songs)
+    if args.from_repository:
+        with open("conf.edn") as f:
+            payloads.update(payloads_from_repository(dict(edn_format.loads(f.read()))))
+    benchmark(payloads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Load test of the API: server-sent events fan-out and polling clients.
+
+Usage: python scripts/load_test.py [OPTIONS] (see --help)
+
+Unless --url is given, a gunicorn server with SunflowerWorker workers is started
+in a temporary directory, with the conf.edn of the current directory using the
+SQLite repository (--backend sqlite, default) or the local redis server
+(--backend redis, for example started with redis-server or redislite).
+
+During --duration seconds:
+
+- --sse-clients clients listen to /events;
+- --pollers clients request /channels/, /channels/<id>, /channels/<id>/schedule
+  and /now-playing in turn, waiting --poll-interval seconds between requests;
+- the current step of a channel (in turn) is updated --update-rate times per
+  second, like the scheduler does.
+
+Then latency percentiles of requests (by route), delivery lag of events
+(from publication to reception by a client, by update id) and memory of
+workers are reported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import urlsplit
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import edn_format
+from sunflower.core.config import K
+from sunflower.core.repository import AsyncRepository
+from sunflower.core.repository import repository_from_config
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "no data"
+    values = sorted(values)
+    return " ".join(
+        f"{name}={values[min(int(len(values) * ratio), len(values) - 1)] * 1000:.1f}ms"
+        for name, ratio in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1)))
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, config: Dict, host: str, port: int):
+        self.args = args
+        self.config = config
+        self.host = host
+        self.port = port
+        self.channels_ids = [channel[K("id")] for channel in config[K("channels")]]
+        self.repository: AsyncRepository = repository_from_config(config, asynchronous=True)
+        # update id -> time of publication
+        self.publication_times: Dict[str, float] = {}
+        self.updates_count = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.lags: List[float] = []
+        self.events_count = 0
+        self.connected_sse_clients = 0
+        self.stopping = False
+
+    async def _request(self, path: str, http_version: str = "1.1") -> Tuple[asyncio.StreamReader,
+                                                                          asyncio.StreamWriter, int, Dict]:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(f"GET {path} HTTP/{http_version}\r\nHost: {self.host}\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return reader, writer, status, headers
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict) -> bytes:
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        body = b""
+        # chunked transfer encoding
+        while size := int((await reader.readline()).strip(), 16):
+            body += await reader.readexactly(size)
+            await reader.readline()
+        await reader.readline()
+        return body
+
+    async def get(self, path: str) -> bytes:
+        """GET path with a new connection, and count latency by route."""
+        route = path.split("?")[0]
+        for channel_id in self.channels_ids:
+            route = route.replace(f"/{channel_id}", "/{channel_id}")
+        start = time.perf_counter()
+        try:
+            reader, writer, status, headers = await self._request(path)
+            body = await self._read_body(reader, headers)
+            writer.close()
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            self.errors[route] += 1
+            return b""
+        if status != 200:
+            self.errors[route] += 1
+        self.latencies[route].append(time.perf_counter() - start)
+        return body
+
+    async def wait_for_server(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                reader, writer, status, headers = await self._request("/channels/")
+                writer.close()
+                if status == 200:
+                    return
+            except (OSError, ValueError, IndexError):
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("Server did not start.")
+
+    async def update_steps(self):
+        """Update current step of a channel (in turn) update_rate times per second."""
+        interval = 1 / self.args.update_rate
+        next_update = time.monotonic()
+        while not self.stopping:
+            channel_id = self.channels_ids[self.updates_count % len(self.channels_ids)]
+            now = int(time.time())
+            step = {"start": now, "end": now + 60, "broadcast": {
+                "title": f"Load test update {self.updates_count}", "type": "Programme", "station": {"name": ""}}}
+            publication_time = time.monotonic()
+            await self.repository.persist_and_publish(
+                f"sunflower:channel:{channel_id}:current", step, None,
+                f"sunflower:channel:{channel_id}:updates", 1)
+            # only this task publishes: the last id of the log is the id of this update
+            _, update_id = await self.repository.update_log_bounds()
+            self.publication_times[update_id] = publication_time
+            self.updates_count += 1
+            next_update += interval
+            await asyncio.sleep(max(next_update - time.monotonic(), 0))
+
+    async def listen_events(self):
+        """Listen to /events and measure delivery lag of update events."""
+        try:
+            # HTTP/1.0: no chunked encoding, events are read line by line
+            reader, writer, status, _ = await self._request("/events", http_version="1.0")
+        except (OSError, ValueError, IndexError):
+            self.errors["/events"] += 1
+            return
+        if status != 200:
+            self.errors["/events"] += 1
+            return
+        self.connected_sse_clients += 1
+        try:
+            while not self.stopping:
+                line = await reader.readline()
+                if not line:
+                    self.errors["/events"] += 1
+                    break
+                if line.startswith(b"id: "):
+                    publication_time = self.publication_times.get(line[4:].strip().decode())
+                    self.events_count += 1
+                    if publication_time is not None:
+                        self.lags.append(time.monotonic() - publication_time)
+        finally:
+            self.connected_sse_clients -= 1
+            writer.close()
+
+    async def poll(self, poller_index: int):
+        paths = ["/channels/", "/now-playing"]
+        for channel_id in self.channels_ids:
+            paths += [f"/channels/{channel_id}", f"/channels/{channel_id}/schedule"]
+        i = poller_index
+        while not self.stopping:
+            await self.get(paths[i % len(paths)])
+            i += 1
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def run(self, workers_pids) -> Dict[int, float]:
+        """Run the test and return peak memory (MiB) of each worker."""
+        await self.wait_for_server()
+        listeners = [asyncio.ensure_future(self.listen_events()) for _ in range(self.args.sse_clients)]
+        # let listeners connect before updates start
+        await asyncio.sleep(1)
+        tasks = [asyncio.ensure_future(self.update_steps())]
+        tasks += [asyncio.ensure_future(self.poll(i)) for i in range(self.args.pollers)]
+        peak_memory: Dict[int, float] = {}
+        deadline = time.monotonic() + self.args.duration
+        while time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            for pid in workers_pids():
+                peak_memory[pid] = max(peak_memory.get(pid, 0), resident_memory(pid) or 0)
+        self.stopping = True
+        # events still in flight are received
+        await asyncio.sleep(1)
+        for task in [*tasks, *listeners]:
+            task.cancel()
+        await asyncio.gather(*tasks, *listeners, return_exceptions=True)
+        return peak_memory
+
+    def report(self, peak_memory: Dict[int, float]):
+        duration = self.args.duration
+        print(f"Updates: {self.updates_count} ({self.updates_count / duration:.1f}/s)")
+        print(f"SSE clients: {self.args.sse_clients} (errors: {self.errors.pop('/events', 0)})")
+        expected_events = self.updates_count * self.args.sse_clients
+        print(f"Events received: {self.events_count}/{expected_events}")
+        print(f"Delivery lag: {percentiles(self.lags)}")
+        for route, latencies in sorted(self.latencies.items()):
+            print(f"GET {route}: {len(latencies)} requests ({len(latencies) / duration:.1f}/s, "
+                  f"errors: {self.errors.pop(route, 0)}) {percentiles(latencies)}")
+        for route, errors in sorted(self.errors.items()):
+            print(f"GET {route}: {errors} errors")
+        for pid, memory in sorted(peak_memory.items()):
+            print(f"Worker {pid}: peak memory {memory:.1f} MiB")
+
+
+def resident_memory(pid: int) -> Optional[float]:
+    """Return resident memory of a process in MiB (read from /proc, None if not available)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def children_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child_pid) for child_pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="URL of a running server (default: start one)")
+    parser.add_argument("--backend", choices=("sqlite", "redis"), default="sqlite",
+                        help="repository of the started server (default: sqlite)")
+    parser.add_argument("--workers", type=int, default=1, help="workers of the started server (default: 1)")
+    parser.add_argument("--sse-clients", type=int, default=100, help="default: 100")
+    parser.add_argument("--pollers", type=int, default=10, help="default: 10")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds (default: 0.1)")
+    parser.add_argument("--update-rate", type=float, default=2, help="updates per second (default: 2)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds (default: 30)")
+    args = parser.parse_args()
+
+    with open("conf.edn") as f:
+        config = dict(edn_format.loads(f.read()))
+    server = None
+    directory = None
+    if args.url is not None:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        directory = tempfile.mkdtemp(prefix="sunflower-load-test-")
+        config[K("repository-backend")] = args.backend
+        config[K("sqlite-path")] = os.path.join(directory, "sunflower.sqlite3")
+        with open(os.path.join(directory, "conf.edn"), "w") as f:
+            f.write(edn_format.dumps(config))
+        host, port = "127.0.0.1", free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-k", "sunflower.core.worker.SunflowerWorker",
+             "--bind", f"{host}:{port}", "--log-level", "warning", "server.server:app"],
+            cwd=directory,
+            env={**os.environ, "PYTHONPATH": PROJECT_DIRECTORY})
+    load_test = LoadTest(args, config, host, port)
+    try:
+        peak_memory = asyncio.run(load_test.run(lambda: children_pids(server.pid) if server is not None else []))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    load_test.report(peak_memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,18 @@ subprocess.run(["git", "pull"])
 print("[Reload on push] Installing dependencies with Poetry...")
 subprocess.run(["poetry", "install", "--no-dev"])
 
+print("[Reload on push] Generating Liquidsoap config...")
+liquidsoap_config_changed = subprocess.run(
+    ["poetry", "run", "python", "scripts/write_config.py", f"{os.environ['HOME']}/radio/sunflower"],
+    capture_output=True, text=True).stdout.strip() != "unchanged"
+if not liquidsoap_config_changed:
+    print("[Reload on push] Liquidsoap config unchanged, Liquidsoap keeps running")
+
 print("[Reload on push] Stopping current Sunflower Radio...")
 with contextlib.suppress(FileNotFoundError, ProcessLookupError):
-    with open("/tmp/sunflower.liquidsoap.pid") as f:
-        os.kill(int(f.read()), signal.SIGTERM)
+    if liquidsoap_config_changed:
+        with open("/tmp/sunflower.liquidsoap.pid") as f:
+            os.kill(int(f.read()), signal.SIGTERM)
     with open("/tmp/sunflower.scheduler.pid") as f:
         os.kill(int(f.read()), signal.SIGTERM)
     with open("/tmp/sunflower.server.pid") as f:
@@ -56,9 +64,10 @@ subprocess.run(["poetry", "run",
     "--forwarded-allow-ips", "*",
     "--capture-output",
     "server.server:app"])
-with open("/tmp/sunflower.liquidsoap.pid", "w") as f:
-    pid = subprocess.Popen(["liquidsoap", f"{os.environ['HOME']}/radio/sunflower.liq"], start_new_session=True).pid
-    f.write(f"{pid}\n")
+if liquidsoap_config_changed:
+    with open("/tmp/sunflower.liquidsoap.pid", "w") as f:
+        pid = subprocess.Popen(["liquidsoap", f"{os.environ['HOME']}/radio/sunflower.liq"], start_new_session=True).pid
+        f.write(f"{pid}\n")
 with open("/tmp/sunflower.scheduler.pid", "w") as f:
     pid = subprocess.Popen(["poetry", "run", "python", "sunflower/scheduler.py"], start_new_session=True).pid
     f.write(f"{pid}\n")
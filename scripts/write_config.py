@@ -1,5 +1,27 @@
+"""Write liquidsoap config file from conf.edn.
+
+Usage: python scripts/write_config.py [FILENAME] [--reload]
+
+FILENAME is the path of the script without ".liq" extension (default: sunflower).
+The file is only rewritten if its content changed; in this case "changed" is
+printed, otherwise "unchanged". With --reload, liquidsoap is restarted only
+if the config changed.
+"""
+import os
+import subprocess
+import sys
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
 from sunflower.core.liquidsoap import write_liquidsoap_config
 from sunflower.channels import channels
 
 
-write_liquidsoap_config(channels, filename="sunflower")
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--reload"]
+    filename = args[0] if args else "sunflower"
+    changed = write_liquidsoap_config(channels, filename=filename)
+    print("changed" if changed else "unchanged")
+    if changed and "--reload" in sys.argv:
+        subprocess.run(["make", "restart-liquidsoap"])
@@ -0,0 +1,121 @@
+"""Per-worker cache of repository values."""
+
+import hashlib
+import json
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
+
+from server.hub import UpdatesHub
+from sunflower.core.repository import AsyncRepository
+
+
+def value_digest(value: Any) -> str:
+    """Return a digest of a jsonable value (or of bytes)."""
+    if isinstance(value, bytes):
+        return hashlib.sha1(value).hexdigest()
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CachedRepository(AsyncRepository):
+    """Keep values read from a repository in memory, in each server worker.
+
+    Cached values of an object are dropped when a message is published on its
+    `updates` channel (for example a message on sunflower:channel:tournesol:updates
+    drops all sunflower:channel:tournesol:* values), and after ttl seconds, as a
+    safety net against lost messages and data persisted without notification.
+
+    Messages are received from the updates hub of the worker. Values are only
+    cached while the hub is connected. Cached values are shared between requests
+    and must not be modified.
+    """
+
+    def __init__(self, repository: AsyncRepository, hub: UpdatesHub, ttl: float = 30):
+        self.repository = repository
+        self.hub = hub
+        self.ttl = ttl
+        self._values: Dict[Tuple[str, Optional[Callable]], Tuple[float, Any]] = {}
+        # key -> (value, digest of value)
+        self._digests: Dict[str, Tuple[Any, str]] = {}
+        # incremented at each invalidation: values read during an invalidation are not cached
+        self._generation = 0
+        hub.callbacks.append(self.on_updates)
+
+    def on_updates(self, channel: Optional[str]):
+        """Drop values of the object of updates channel (all values if channel is None)."""
+        # sunflower:channel:tournesol:updates -> sunflower:channel:tournesol:
+        self.invalidate(channel.removesuffix("updates") if channel is not None else "")
+
+    def invalidate(self, prefix: str = ""):
+        """Drop cached values of keys starting with prefix (all values by default)."""
+        self._generation += 1
+        for cache_key in [cache_key for cache_key in self._values if cache_key[0].startswith(prefix)]:
+            del self._values[cache_key]
+        for key in [key for key in self._digests if key.startswith(prefix)]:
+            del self._digests[key]
+
+    def etag(self, keys: Iterable[str], values: Iterable[Any]) -> str:
+        """Return ETag of values retrieved for keys.
+
+        The digest of a value is computed once as long as the same value is cached.
+        """
+        digest = hashlib.sha1()
+        for key, value in zip(keys, values):
+            value_and_digest = self._digests.get(key)
+            if value_and_digest is None or value_and_digest[0] is not value:
+                value_and_digest = self._digests[key] = (value, value_digest(value))
+            digest.update(value_and_digest[1].encode())
+        return f'"{digest.hexdigest()}"'
+
+    async def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        return (await self.retrieve_many([key], object_hook))[0]
+
+    async def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys, fetching missing or expired ones with one repository call."""
+        keys = list(keys)
+        self.hub.start()
+        now = time.monotonic()
+        values = {}
+        missing_keys = []
+        for key in keys:
+            expires_at, value = self._values.get((key, object_hook), (0, None))
+            if expires_at > now:
+                values[key] = value
+            else:
+                missing_keys.append(key)
+        if missing_keys:
+            generation, connected = self._generation, self.hub.connected
+            fetched_values = await self.repository.retrieve_many(missing_keys, object_hook)
+            if connected and self.hub.connected and generation == self._generation:
+                for key, value in zip(missing_keys, fetched_values):
+                    self._values[(key, object_hook)] = (now + self.ttl, value)
+            values.update(zip(missing_keys, fetched_values))
+        return [values[key] for key in keys]
+
+    async def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        self.invalidate(key)
+        return await self.repository.persist(key, value, json_encoder_cls)
+
+    async def publish(self, channel, data):
+        await self.repository.publish(channel, data)
+
+    async def persist_and_publish(self,
+                                  key: str,
+                                  value: Any,
+                                  json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                                  channel,
+                                  data):
+        self.invalidate(key)
+        await self.repository.persist_and_publish(key, value, json_encoder_cls, channel, data)
+
+    async def update_log_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        return await self.repository.update_log_bounds()
+
+    async def read_updates(self, after_id: str, timeout: float = 0) -> List[Tuple[str, str, bytes]]:
+        return await self.repository.read_updates(after_id, timeout)
@@ -0,0 +1,159 @@
+"""Fan-out of repository messages to all clients of a server worker."""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from server.metrics import ServerMetrics
+from sunflower.core.repository import AsyncRepository
+from sunflower.core.repository import update_id_key
+
+logger = logging.getLogger(__name__)
+
+# put in queues of all clients every heartbeat_interval seconds
+HEARTBEAT = None
+# put in the queue of a client in place of the messages it could not keep up with
+OVERFLOW = "overflow"
+
+
+class UpdatesHub:
+    """Listen to updates channels once per worker and dispatch messages to clients.
+
+    A task started at first use reads the update log of the repository and puts
+    (id, channel, data) messages of updates_channels in the queue of each client
+    subscribed to the channel (see client()). The same task puts HEARTBEAT in
+    all queues every heartbeat_interval seconds. When the queue of a client is
+    full, its messages are dropped and replaced with OVERFLOW: the client must
+    get the data of its channels again (or replay missed updates).
+
+    Callbacks are called with the channel of each message, and with None
+    when messages may have been lost (when listening starts or stops).
+
+    If metrics are given, the lag of each message is recorded.
+    """
+
+    def __init__(self,
+                 repository: AsyncRepository,
+                 updates_channels: Iterable[str],
+                 heartbeat_interval: float = 4,
+                 max_queue_size: int = 100,
+                 metrics: Optional[ServerMetrics] = None):
+        self.repository = repository
+        self.metrics = metrics
+        self.updates_channels = list(updates_channels)
+        self.heartbeat_interval = heartbeat_interval
+        self.max_queue_size = max_queue_size
+        self.callbacks: List[Callable[[Optional[str]], None]] = []
+        self.connected = False
+        self._queues_by_channel: Dict[str, Set[asyncio.Queue]] = {channel: set() for channel in self.updates_channels}
+        self._queues: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start listening in the running event loop, if not started yet."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    @contextmanager
+    def client(self,
+               channels: Iterable[str] = ()) -> Iterator["asyncio.Queue[Union[None, str, Tuple[str, str, bytes]]]"]:
+        """Register a client listening to given channels, and yield its queue.
+
+        The client can listen to other channels later (see subscribe() and unsubscribe()).
+        """
+        self.start()
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue_size)
+        self._queues.add(queue)
+        self.subscribe(queue, channels)
+        try:
+            yield queue
+        finally:
+            self._queues.discard(queue)
+            self.unsubscribe(queue, self.updates_channels)
+
+    def subscribe(self, queue: asyncio.Queue, channels: Iterable[str]):
+        """Put messages of given channels in queue of a client too (unknown channels are ignored)."""
+        for channel in channels:
+            if channel in self._queues_by_channel:
+                self._queues_by_channel[channel].add(queue)
+
+    def unsubscribe(self, queue: asyncio.Queue, channels: Iterable[str]):
+        """Stop putting messages of given channels in queue of a client."""
+        for channel in channels:
+            if channel in self._queues_by_channel:
+                self._queues_by_channel[channel].discard(queue)
+
+    @property
+    def clients_count(self) -> int:
+        return len(self._queues)
+
+    async def replay(self, last_id: str, channels: Iterable[str]) -> Optional[List[Tuple[str, str, bytes]]]:
+        """Return (id, channel, data) messages of channels published after last_id.
+
+        Return None if some of them may have been dropped from the update log
+        (if last_id is not valid, or older than the first message of the log).
+        """
+        try:
+            last_id_key = update_id_key(last_id)
+        except ValueError:
+            return None
+        first_id, _ = await self.repository.update_log_bounds()
+        if first_id is None or update_id_key(first_id) > last_id_key:
+            return None
+        channels = set(channels)
+        return [update for update in await self.repository.read_updates(last_id) if update[1] in channels]
+
+    @staticmethod
+    def _put(queues: Iterable[asyncio.Queue], item):
+        for queue in queues:
+            if not queue.full():
+                queue.put_nowait(item)
+                continue
+            logger.warning(f"Queue of a client is full ({queue.qsize()} messages), its messages are dropped.")
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(OVERFLOW)
+
+    def _notify(self, channel: Optional[str]):
+        for callback in self.callbacks:
+            callback(channel)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except Exception:
+                logger.exception("Updates listening stopped, retrying in 1 second.")
+            finally:
+                self.connected = False
+                self._notify(None)
+            await asyncio.sleep(1)
+
+    async def _listen(self):
+        _, last_id = await self.repository.update_log_bounds()
+        last_id = last_id or "0"
+        self.connected = True
+        self._notify(None)
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while True:
+            updates = await self.repository.read_updates(last_id, timeout=max(next_heartbeat - time.monotonic(), 0.01))
+            for update in updates:
+                last_id, channel, _ = update
+                if self.metrics is not None:
+                    self.metrics.record_update(last_id)
+                if channel in self._queues_by_channel:
+                    self._notify(channel)
+                    self._put(self._queues_by_channel[channel], update)
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+                self._put(self._queues, HEARTBEAT)
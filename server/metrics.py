@@ -0,0 +1,171 @@
+"""Operational metrics of a server worker, exposed in Prometheus text format."""
+
+import os
+import time
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+from sunflower.core.metrics import RepositoryMetrics
+from sunflower.core.repository import update_id_time
+
+# upper bounds (seconds) of histogram buckets
+REQUEST_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+UPDATE_LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    escaped_labels = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped_labels) + "}"
+
+
+def histogram_samples(name: str,
+                      labels: Dict[str, str],
+                      buckets: Sequence[float],
+                      counts: Sequence[int],
+                      total: float) -> Iterator[str]:
+    """Yield samples of a histogram; counts[i] is the number of values in bucket i (last one is +Inf)."""
+    cumulative_count = 0
+    for bound, count in zip((*buckets, "+Inf"), counts):
+        cumulative_count += count
+        yield f"{name}_bucket{format_labels({**labels, 'le': bound})} {cumulative_count}"
+    yield f"{name}_sum{format_labels(labels)} {total}"
+    yield f"{name}_count{format_labels(labels)} {cumulative_count}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterator[str]:
+        return histogram_samples(name, labels, self.buckets, self.counts, self.sum)
+
+
+class ServerMetrics:
+    """Count requests by route and measure latencies of a server worker.
+
+    The latency of a request is the time until its response starts (streamed
+    responses like server-sent events are not measured until they end). The
+    lag of an update is the time between its publication and its dispatch
+    by the updates hub, known only for update ids holding a timestamp (redis).
+    """
+
+    def __init__(self):
+        # (method, route, status) -> number of requests
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.request_latencies: Dict[Tuple[str, str], Histogram] = {}
+        self.update_lag = Histogram(UPDATE_LAG_BUCKETS)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float):
+        self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+        histogram = self.request_latencies.get((method, route))
+        if histogram is None:
+            histogram = self.request_latencies[(method, route)] = Histogram(REQUEST_LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def record_update(self, update_id: str):
+        published_at = update_id_time(update_id)
+        if published_at is not None:
+            self.update_lag.observe(max(time.time() - published_at, 0))
+
+    def render(self,
+               repository_metrics: RepositoryMetrics,
+               updates_clients: int,
+               updates_connected: bool) -> str:
+        """Return all metrics of the worker in Prometheus text format (labelled with the worker pid)."""
+        worker = {"worker": str(os.getpid())}
+        lines: List[str] = [
+            "# HELP sunflower_http_requests_total Requests by route and status.",
+            "# TYPE sunflower_http_requests_total counter",
+            *(f"sunflower_http_requests_total"
+              f"{format_labels({**worker, 'method': method, 'route': route, 'status': status})} {count}"
+              for (method, route, status), count in sorted(self.requests.items())),
+            "# HELP sunflower_http_request_duration_seconds Time until response start, by route.",
+            "# TYPE sunflower_http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.request_latencies.items()):
+            lines.extend(histogram.samples(
+                "sunflower_http_request_duration_seconds", {**worker, "method": method, "route": route}))
+        lines += [
+            "# HELP sunflower_updates_clients Clients listening to updates (server-sent events and websockets).",
+            "# TYPE sunflower_updates_clients gauge",
+            f"sunflower_updates_clients{format_labels(worker)} {updates_clients}",
+            "# HELP sunflower_updates_connected 1 if the worker listens to updates of the repository.",
+            "# TYPE sunflower_updates_connected gauge",
+            f"sunflower_updates_connected{format_labels(worker)} {int(updates_connected)}",
+            "# HELP sunflower_update_lag_seconds Time between publication and dispatch of updates.",
+            "# TYPE sunflower_update_lag_seconds histogram",
+            *self.update_lag.samples("sunflower_update_lag_seconds", worker),
+        ]
+        lines.extend(repository_samples(repository_metrics, worker))
+        return "\n".join(lines) + "\n"
+
+
+def repository_samples(repository_metrics: RepositoryMetrics, labels: Dict[str, str]) -> Iterable[str]:
+    snapshot = repository_metrics.snapshot()
+    yield "# HELP sunflower_repository_operation_seconds Latency of repository operations, by key family."
+    yield "# TYPE sunflower_repository_operation_seconds histogram"
+    for family, operations in snapshot["families"].items():
+        for operation, stats in operations.items():
+            yield from histogram_samples(
+                "sunflower_repository_operation_seconds", {**labels, "operation": operation, "family": family},
+                snapshot["latency_buckets"], stats["latency_counts"], stats["seconds"])
+    yield "# HELP sunflower_repository_bytes_total Bytes read or written by repository operations, by key family."
+    yield "# TYPE sunflower_repository_bytes_total counter"
+    for family, operations in snapshot["families"].items():
+        for operation, stats in operations.items():
+            yield (f"sunflower_repository_bytes_total"
+                   f"{format_labels({**labels, 'operation': operation, 'family': family})} {stats['bytes']}")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording requests in metrics.
+
+    Requests are grouped by route template (like /channels/{channel_id}),
+    requests matching no route are grouped in "unmatched".
+    """
+
+    def __init__(self, app, metrics: ServerMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        response_started = False
+
+        def record(status: int):
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.metrics.record_request(scope["method"], route, status, time.perf_counter() - start)
+
+        async def send_and_record(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start" and not response_started:
+                response_started = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        except Exception:
+            if not response_started:
+                record(500)
+            raise
@@ -1,14 +1,22 @@
 import abc
 
 from sunflower.core.persistence import PersistenceMixin
-from sunflower.core.repository import Repository
+from sunflower.core.repository import AsyncRepository
 
 
 class Proxy(abc.ABC, PersistenceMixin):
+    """Read persisted data of an object from the server.
+
+    Proxies use an AsyncRepository: get() must be awaited.
+    """
     data_type = abc.abstractproperty()
 
-    def __getattr__(self, name):
-        return self.retrieve_from_repository(name)
+    async def get(self, name):
+        return await self.retrieve_from_repository(name)
+
+    async def get_many(self, *names):
+        """Get several values with one repository call."""
+        return await self.retrieve_many_from_repository(list(names))
 
 
 class ChannelProxy(Proxy):
@@ -18,5 +26,12 @@ class ChannelProxy(Proxy):
 class PycoloreProxy(Proxy):
     data_type = "station"
 
-    def __init__(self, repository: Repository, *args, **kwargs):
+    def __init__(self, repository: AsyncRepository, *args, **kwargs):
         super().__init__(repository, "pycolore", *args, **kwargs)
+
+
+class NowPlayingProxy(Proxy):
+    data_type = "now-playing"
+
+    def __init__(self, repository: AsyncRepository, *args, **kwargs):
+        super().__init__(repository, "all", *args, **kwargs)
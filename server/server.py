@@ -1,27 +1,47 @@
 import asyncio
 import json
-from collections import defaultdict
+import time
 from datetime import datetime
 from enum import Enum
 from typing import List
+from typing import Optional
+from typing import Tuple
 
-import aredis
 from fastapi import FastAPI
+from fastapi import HTTPException
+from fastapi import Header
 from fastapi import Query
+from fastapi import WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import AnyHttpUrl
 from pydantic.dataclasses import dataclass as pydantic_dataclass
 from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.responses import Response
 from starlette.responses import StreamingResponse
 
+from server.hub import HEARTBEAT
+from server.hub import OVERFLOW
+from server.metrics import MetricsMiddleware
+from server.proxies import NowPlayingProxy
 from server.proxies import PycoloreProxy
 from server.utils import channels_ids
+from server.utils import conditional_response
 from server.utils import get_channel_or_404
-from server.utils import redis_repo
+from server.utils import hub
+from server.utils import max_age_until
+from server.utils import metrics
+from server.utils import repository
+from server.utils import response_body
 from sunflower.core.config import K
 from sunflower.core.config import get_config
 from sunflower.core.custom_types import NotifyChangeStatus
 from sunflower.core.custom_types import Step
+from sunflower.core.metrics import repository_metrics
+from sunflower.core.repository import update_id_key
+from sunflower.core.responses import response_key
+from sunflower.utils.music import group_by_artist
+from sunflower.utils.search import SearchIndex
 
 app = FastAPI(
     title=get_config()[K("radio-name")],
@@ -34,6 +54,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"])
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 
 # models
@@ -54,19 +75,30 @@ class Channel:
     tags=["Channel-related endpoints"],
     summary="Channels list",
     response_description="List of channels URLs.")
-def channels_list(request: Request):
+async def channels_list(request: Request):
     """Get the list of the channels: their endpoints and a link to their resource."""
+    # entries written by the scheduler are joined if all are there
+    entries = await repository.retrieve_many(
+        [get_channel_or_404(channel_id).repository_key(response_key("entry")) for channel_id in channels_ids])
+    if None not in entries:
+        return Response(b"[" + b",".join(entries) + b"]", media_type="application/json")
+    # current and next steps of all channels are fetched at once
+    keys = [
+        get_channel_or_404(channel_id).repository_key(key)
+        for channel_id in channels_ids
+        for key in ("current", "next")]
+    steps = await repository.retrieve_many(keys)
     return [
         {
             "id": channel_id,
             "name": channel_id.capitalize(),
             "url": request.url_for("get_channel", channel_id=channel_id),
             "schedule_url": request.url_for("get_schedule_of", channel_id=channel_id),
-            "current_step": get_channel_or_404(channel_id).current,
-            "next_step": get_channel_or_404(channel_id).next,
+            "current_step": current_step,
+            "next_step": next_step,
             "audio_stream": get_config()[K("icecast-server-url")] + channel_id,
         }
-        for channel_id in channels_ids]
+        for channel_id, current_step, next_step in zip(channels_ids, steps[::2], steps[1::2])]
 
 
 @app.get(
@@ -74,7 +106,7 @@ def channels_list(request: Request):
     summary="Channel information",
     response_description="Channel information and related links",
     tags=["Channel-related endpoints"])
-def get_channel(channel_id, request: Request):
+async def get_channel(channel_id, request: Request):
     """Display information about one channel :
 
     - its endpoint
@@ -84,59 +116,225 @@ def get_channel(channel_id, request: Request):
     - the url to the schedule of this channel
 
     One path parameter is needed: the endpoint of the channel. URLs to all channels are given at /channels/ endpoint.
+
+    The response can be cached until the end of the current step (see ETag and Cache-Control headers).
     """
     channel = get_channel_or_404(channel_id)
-    return {
+    current_step, next_step, body, compressed_body = await channel.get_many(
+        "current", "next", response_key("detail"), response_key("detail", compressed=True))
+    max_age = max_age_until((current_step or {}).get("end"))
+    body, compressed = response_body(request, body, compressed_body)
+    if body is not None:
+        etag = repository.etag([channel.repository_key(response_key("detail", compressed))], [body])
+        return conditional_response(request, lambda: body, etag, max_age, compressed)
+    etag = repository.etag(
+        [channel.repository_key("current"), channel.repository_key("next")], [current_step, next_step])
+    return conditional_response(request, lambda: {
         "endpoint": channel.id,
         "name": channel.id.capitalize(),
         "audio_stream": get_config()[K("icecast-server-url")] + channel.id,
-        "current_step": channel.current,
-        "next_step": channel.next,
+        "current_step": current_step,
+        "next_step": next_step,
         "schedule": request.url_for("get_schedule_of", channel_id=channel.id),
-    }
-
-
-async def updates_generator(request, *endpoints):
-    pubsub = aredis.StrictRedis().pubsub()
-    for endpoint in endpoints:
-        await pubsub.subscribe(f"sunflower:channel:{endpoint}:updates")
-    while True:
-        client_disconnected = await request.is_disconnected()
-        if client_disconnected:
-            print(datetime.now(), "Disconnected")
-            break
-        try:
-            message = await asyncio.wait_for(pubsub.get_message(), timeout=4)
-        except asyncio.TimeoutError:
-            yield ":\n\n"
-            continue
-        if message is None:
-            continue
-        redis_data = message.get("data")
-        if redis_data != str(NotifyChangeStatus.UPDATED.value).encode():
-            continue
-        redis_channel = message.get("channel").decode()
-        channel_endpoint = redis_channel.split(":")[2]
-        data_to_send = {"channel": channel_endpoint, "status": "updated"}
-        yield f'data: {json.dumps(data_to_send)}\n\n'
+    }, etag, max_age)
+
+
+@app.get(
+    "/now-playing",
+    summary="Current and next steps of channels",
+    response_description="Current and next steps by channel id",
+    tags=["Channel-related endpoints"])
+async def get_now_playing(request: Request, channel: List[str] = Query(channels_ids)):
+    """Get current and next steps of all channels, or of the channels given in `channel` query parameters.
+
+    The response can be cached until the end of the first current step to end (see ETag and
+    Cache-Control headers).
+    """
+    for channel_id in channel:
+        get_channel_or_404(channel_id)
+    now_playing = NowPlayingProxy(repository)
+    # one read for all selected channels
+    keys = [f"steps:{channel_id}" for channel_id in channel]
+    steps = await now_playing.get_many(*keys)
+    selected_steps = dict(zip(channel, steps))
+    current_step_end = min(
+        (channel_steps["current_step"]["end"]
+         for channel_steps in selected_steps.values()
+         if channel_steps is not None and channel_steps["current_step"] is not None),
+        default=None)
+    etag = repository.etag([now_playing.repository_key(key) for key in keys], steps)
+    return conditional_response(request, lambda: selected_steps, etag, max_age_until(current_step_end))
+
+
+def format_update_event(update_id: str, channel_endpoint: str) -> str:
+    data_to_send = {"channel": channel_endpoint, "status": "updated"}
+    return f'id: {update_id}\ndata: {json.dumps(data_to_send)}\n\n'
+
+
+async def updates_generator(request, *endpoints, last_event_id: Optional[str] = None):
+    channels = [f"sunflower:channel:{endpoint}:updates" for endpoint in endpoints]
+    updated_data = str(NotifyChangeStatus.UPDATED.value).encode()
+    with hub.client(channels) as queue:
+        last_id_key = None
+        if last_event_id is not None:
+            # replay updates missed by a reconnecting client
+            updates = await hub.replay(last_event_id, channels)
+            if updates is None:
+                # some updates are lost: client must get all channels again
+                _, last_id = await repository.update_log_bounds()
+                for endpoint in endpoints:
+                    yield format_update_event(last_id or "0", endpoint)
+                updates = []
+                last_id_key = update_id_key(last_id or "0")
+            for update_id, redis_channel, redis_data in updates:
+                last_id_key = update_id_key(update_id)
+                if redis_data == updated_data:
+                    yield format_update_event(update_id, redis_channel.split(":")[2])
+        while True:
+            message = await queue.get()
+            if message is HEARTBEAT:
+                if await request.is_disconnected():
+                    print(datetime.now(), "Disconnected")
+                    break
+                yield ":\n\n"
+                continue
+            if message == OVERFLOW:
+                # updates were dropped: the client reconnects with Last-Event-ID and they are replayed
+                break
+            update_id, redis_channel, redis_data = message
+            if last_id_key is not None and update_id_key(update_id) <= last_id_key:
+                # already replayed
+                continue
+            if redis_data != updated_data:
+                continue
+            yield format_update_event(update_id, redis_channel.split(":")[2])
 
 
 @app.get("/events", tags=["Server-sent events"])
-async def update_broadcast_info_stream(request: Request, channel: List[str] = Query(channels_ids)):
-    return StreamingResponse(updates_generator(request, *channel),
+async def update_broadcast_info_stream(request: Request,
+                                       channel: List[str] = Query(channels_ids),
+                                       last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Stream an event each time a channel is updated.
+
+    Events have an id: a reconnecting client sending the Last-Event-ID header gets the
+    updates it missed (or an event for each channel if they are too old). The stream is
+    closed if the client does not keep up with updates, so that it reconnects.
+    """
+    return StreamingResponse(updates_generator(request, *channel, last_event_id=last_event_id),
                              media_type="text/event-stream",
                              headers={"access-control-allow-origin": "*"})
 
 
+async def channel_steps_message(channel_id: str, update_id: Optional[str] = None) -> dict:
+    current_step, next_step = await get_channel_or_404(channel_id).get_many("current", "next")
+    return {"type": "steps", "channel": channel_id, "id": update_id,
+            "current_step": current_step, "next_step": next_step}
+
+
+def parse_subscription_request(message: dict) -> Tuple[str, List[str]]:
+    """Return action and channels of a websocket message of a client, or raise ValueError."""
+    if message.get("text") is None:
+        raise ValueError("Only text messages are accepted.")
+    try:
+        request = json.loads(message["text"])
+    except ValueError:
+        raise ValueError("Message is not valid JSON.") from None
+    if not isinstance(request, dict):
+        raise ValueError('Message must be an object like {"action": "subscribe", "channels": [...]}.')
+    action, channels = request.get("action"), request.get("channels")
+    if action not in ("subscribe", "unsubscribe"):
+        raise ValueError(f"Unknown action {action!r}.")
+    if not isinstance(channels, list) or not all(isinstance(channel, str) for channel in channels):
+        raise ValueError("channels must be a list of channel ids.")
+    unknown_channels = [channel for channel in channels if channel not in channels_ids]
+    if unknown_channels:
+        raise ValueError(f"Unknown channels {unknown_channels!r}.")
+    return action, channels
+
+
+@app.websocket("/ws")
+async def updates_websocket(websocket: WebSocket):
+    """Push current and next steps of channels each time they are updated.
+
+    The client sends {"action": "subscribe" or "unsubscribe", "channels": [...]} messages to change the
+    channels it listens to. Steps of a channel are sent at once when subscribing, and then at each update,
+    as {"type": "steps", "channel": ..., "id": ..., "current_step": ..., "next_step": ...}. Invalid messages
+    (including binary ones) get an {"type": "error", "message": ...} answer. If the client does not keep up
+    with updates, steps of all its channels are sent again.
+    """
+    await websocket.accept()
+    subscribed_channels = set()
+    updated_data = str(NotifyChangeStatus.UPDATED.value).encode()
+    with hub.client() as queue:
+        # messages of the client and of the hub are awaited together so that only this task sends
+        receive_task = asyncio.ensure_future(websocket.receive())
+        get_task = asyncio.ensure_future(queue.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait({receive_task, get_task}, return_when=asyncio.FIRST_COMPLETED)
+                if receive_task in done:
+                    message = receive_task.result()
+                    if message["type"] == "websocket.disconnect":
+                        break
+                    receive_task = asyncio.ensure_future(websocket.receive())
+                    try:
+                        action, channels = parse_subscription_request(message)
+                    except ValueError as err:
+                        await websocket.send_json({"type": "error", "message": str(err)})
+                        continue
+                    updates_channels = [f"sunflower:channel:{channel}:updates" for channel in channels]
+                    if action == "unsubscribe":
+                        hub.unsubscribe(queue, updates_channels)
+                        subscribed_channels.difference_update(channels)
+                        continue
+                    hub.subscribe(queue, updates_channels)
+                    for channel in channels:
+                        if channel not in subscribed_channels:
+                            subscribed_channels.add(channel)
+                            await websocket.send_json(await channel_steps_message(channel))
+                if get_task in done:
+                    message = get_task.result()
+                    get_task = asyncio.ensure_future(queue.get())
+                    if message is HEARTBEAT:
+                        continue
+                    if message == OVERFLOW:
+                        # updates were dropped
+                        for channel in subscribed_channels:
+                            await websocket.send_json(await channel_steps_message(channel))
+                        continue
+                    update_id, redis_channel, redis_data = message
+                    channel = redis_channel.split(":")[2]
+                    # messages queued before unsubscribing are skipped
+                    if redis_data == updated_data and channel in subscribed_channels:
+                        await websocket.send_json(await channel_steps_message(channel, update_id))
+        finally:
+            receive_task.cancel()
+            get_task.cancel()
+
+
 @app.get(
     "/channels/{channel_id}/schedule",
     summary="Get schedule of given channel",
     tags=["Channel-related endpoints"],
     response_model=List[Step],
     response_description="List of steps containing start and end timestamps, and broadcasts")
-def get_schedule_of(channel_id):
-    """Get information about next broadcast on given channel"""
-    return get_channel_or_404(channel_id).schedule
+async def get_schedule_of(channel_id, request: Request):
+    """Get information about next broadcast on given channel
+
+    The response can be cached until the end of the current step of the schedule (see ETag and
+    Cache-Control headers).
+    """
+    channel = get_channel_or_404(channel_id)
+    schedule, body, compressed_body = await channel.get_many(
+        "schedule", response_key("schedule"), response_key("schedule", compressed=True))
+    now = time.time()
+    current_step_end = next((step["end"] for step in schedule or () if step["end"] > now), None)
+    body, compressed = response_body(request, body, compressed_body)
+    if body is not None:
+        etag = repository.etag([channel.repository_key(response_key("schedule", compressed))], [body])
+        return conditional_response(request, lambda: body, etag, max_age_until(current_step_end), compressed)
+    etag = repository.etag([channel.repository_key("schedule")], [schedule])
+    return conditional_response(request, lambda: schedule, etag, max_age_until(current_step_end))
 
 # custom endpoints
 
@@ -146,18 +344,97 @@ class ShapeEnum(str, Enum):
     groupartist = 'groupartist'
 
 
+# chunks of a playlist view read at once when the whole view is streamed
+PLAYLIST_CHUNKS_BATCH = 10
+
+
+def playlist_view_brackets(shape: ShapeEnum) -> Tuple[bytes, bytes]:
+    return (b"[", b"]") if shape == ShapeEnum.flat else (b"{", b"}")
+
+
+async def playlist_view_generator(proxy: PycoloreProxy, shape: ShapeEnum, chunks_count: int):
+    opening_bracket, closing_bracket = playlist_view_brackets(shape)
+    yield opening_bracket
+    separator = b""
+    for start in range(0, chunks_count, PLAYLIST_CHUNKS_BATCH):
+        end = min(start + PLAYLIST_CHUNKS_BATCH, chunks_count)
+        chunks = await proxy.get_many(*(f"playlist:{shape.value}:{index}" for index in range(start, end)))
+        for chunk in chunks:
+            if chunk:
+                yield separator + chunk
+                separator = b","
+    yield closing_bracket
+
+
 @app.get(
     "/stations/pycolore/playlist",
     summary="Get the playlist of Pycolore station",
     tags=["Endpoints specific to Radio Pycolore"],
     response_description="List of songs of the playlist")
-def get_pycolore_playlist(shape: ShapeEnum = ShapeEnum.flat.value):
-    """Get information about next broadcast on given channel"""
-    if shape == ShapeEnum.flat.value:
-        return PycoloreProxy(redis_repo).playlist
-    if shape == ShapeEnum.groupartist.value:
-        playlist = PycoloreProxy(redis_repo).playlist
-        sorted_playlist = defaultdict(list)
-        for song in playlist:
-            sorted_playlist[song["artist"]].append({'title': song["title"], 'album': song["album"]})
-        return sorted_playlist
+async def get_pycolore_playlist(shape: ShapeEnum = ShapeEnum.flat.value,
+                                paginate: bool = False,
+                                cursor: Optional[str] = None):
+    """Get the songs of the playlist, as a list (flat shape) or grouped by artist (groupartist shape).
+
+    The whole playlist is streamed, unless pages are requested with `paginate`. A page contains
+    `items` (songs or artists) and `next_cursor`, to give as `cursor` parameter for the next page
+    (null on the last page).
+    """
+    proxy = PycoloreProxy(repository)
+    version, index = None, 0
+    if cursor is not None:
+        version, _, index = cursor.partition(".")
+        if not index.isdigit():
+            raise HTTPException(400, "Invalid cursor.")
+        index = int(index)
+    # views are precomputed by the scheduler, pages are read with one call
+    views, chunk = await proxy.get_many("playlist:views", f"playlist:{shape.value}:{index}")
+    if views is None:
+        # views not written yet by the scheduler
+        playlist = await proxy.get("playlist")
+        if shape == ShapeEnum.flat.value:
+            return playlist
+        return group_by_artist(playlist or [])
+    if not paginate and cursor is None:
+        return StreamingResponse(playlist_view_generator(proxy, shape, views[shape.value]),
+                                 media_type="application/json")
+    if version is not None and version != views["version"]:
+        raise HTTPException(410, "Playlist changed, pagination must be restarted.")
+    next_cursor = f"{views['version']}.{index + 1}" if index + 1 < views[shape.value] else None
+    opening_bracket, closing_bracket = playlist_view_brackets(shape)
+    return Response(
+        b'{"items":' + opening_bracket + (chunk or b"") + closing_bracket
+        + b',"next_cursor":' + json.dumps(next_cursor).encode() + b"}",
+        media_type="application/json")
+
+
+# search index of the worker, loaded again when the version of the playlist changes
+pycolore_search_index: Tuple[Optional[str], SearchIndex] = (None, SearchIndex.build([]))
+
+
+@app.get(
+    "/stations/pycolore/search",
+    summary="Search songs of the playlist of Pycolore station",
+    tags=["Endpoints specific to Radio Pycolore"],
+    response_description="List of matching songs")
+async def search_pycolore_playlist(q: str, limit: int = Query(20, ge=1, le=100)):
+    """Search songs by artist, album and title.
+
+    Case and accents are ignored, and each word of the query matches words starting with it, so
+    that incomplete queries can be used for autocompletion.
+    """
+    global pycolore_search_index
+    proxy = PycoloreProxy(repository)
+    version = ((await proxy.get("playlist:views")) or {}).get("version")
+    if version != pycolore_search_index[0]:
+        data = await proxy.get("playlist:search")
+        pycolore_search_index = (version, SearchIndex.from_data(data) if data is not None else SearchIndex.build([]))
+    return pycolore_search_index[1].search(q, limit)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Operational metrics of the worker handling the request, in Prometheus text format."""
+    return PlainTextResponse(
+        metrics.render(repository_metrics, hub.clients_count, hub.connected),
+        media_type="text/plain; version=0.0.4")
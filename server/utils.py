@@ -1,20 +1,109 @@
 """Utilitary classes used in several parts of sunflower application."""
 
+import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
 from sunflower.core.config import K
 from sunflower.core.config import get_config
 from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.responses import Response
+from server.cache import CachedRepository
+from server.hub import UpdatesHub
+from server.metrics import ServerMetrics
 from server.proxies import ChannelProxy
-from sunflower.core.repository import RedisRepository
-
+from sunflower.core.repository import repository_from_config
 
-redis_repo = RedisRepository()
 
 definitions = get_config()
+
 channels_definitions = definitions[K("channels")]
 channels_ids = [channel_def[K("id")] for channel_def in channels_definitions]
 
+# one repository (and one connection pool) per worker
+base_repository = repository_from_config(definitions, asynchronous=True)
+
+# operational metrics of the worker (see /metrics)
+metrics = ServerMetrics()
+
+# one subscription to updates per worker, shared by all clients of server-sent events
+hub = UpdatesHub(
+    base_repository,
+    metrics=metrics,
+    updates_channels=[
+        *(f"sunflower:channel:{channel_id}:updates" for channel_id in channels_ids),
+        "sunflower:station:pycolore:updates",
+        "sunflower:now-playing:all:updates"])
+
+# values are cached until they are updated
+repository = CachedRepository(base_repository, hub, ttl=definitions.get(K("server-cache-ttl"), 30))
+
 
 def get_channel_or_404(channel: str):
     if channel not in channels_ids:
         raise HTTPException(404, f"Channel {channel} does not exist")
-    return ChannelProxy(redis_repo, channel)
+    return ChannelProxy(repository, channel)
+
+
+# responses are cached at most this number of seconds, so that clients notified of an update
+# by server-sent events get new data (they should also revalidate, which is cheap with ETags)
+MAX_AGE = 60
+
+
+def max_age_until(end: Optional[int]) -> int:
+    """Return max-age of a response which is valid until end timestamp."""
+    if end is None:
+        return 0
+    return max(0, min(int(end - time.time()), MAX_AGE))
+
+
+def accepts_gzip(request: Request) -> bool:
+    """Return True if gzip is in Accept-Encoding header of request (and not refused with q=0)."""
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            try:
+                return float(params.strip().removeprefix("q=") or 1) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def response_body(request: Request,
+                  body: Optional[bytes],
+                  compressed_body: Optional[bytes]) -> Tuple[Optional[bytes], bool]:
+    """Choose between a response body written by the scheduler and its compressed version.
+
+    Return (body, compressed). body is None if it was not written.
+    """
+    if compressed_body is not None and accepts_gzip(request):
+        return compressed_body, True
+    return body, False
+
+
+def conditional_response(request: Request,
+                         get_content: Callable[[], Any],
+                         etag: str,
+                         max_age: int,
+                         compressed: bool = False) -> Response:
+    """Return 304 response if request has etag in If-None-Match, otherwise get_content() as json.
+
+    get_content() can also return a ready-to-serve json body (bytes), gzip-compressed if compressed is True.
+    Both responses have ETag and Cache-Control headers.
+    """
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    content = get_content()
+    if not isinstance(content, bytes):
+        return JSONResponse(jsonable_encoder(content), headers=headers)
+    headers["Vary"] = "Accept-Encoding"
+    if compressed:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content, media_type="application/json", headers=headers)
@@ -3,7 +3,11 @@
 from sunflower.core.channel import Channel
 from sunflower.core.config import get_config
 from sunflower.core.config import K
-from sunflower.core.repository import RedisRepository
+from sunflower.core.publishers import NowPlaying
+from sunflower.core.publishers import SnapshotPublisher
+from sunflower.core.repository import WriteBehindRepository
+from sunflower.core.repository import repository_from_config
+from sunflower.core.responses import ResponseBodies
 from sunflower.stations import FranceCulture
 from sunflower.stations import FranceInfo
 from sunflower.stations import FranceInter
@@ -18,7 +22,11 @@ channels_definitions = definitions[K("channels")]
 stations_definitions = definitions[K("stations")]
 
 # instantiate repository
-redis_repository = RedisRepository()
+# writes are journaled while the repository is unavailable
+repository = WriteBehindRepository(
+    repository_from_config(definitions),
+    path=definitions.get(K("write-behind-journal")),
+    max_entries=definitions.get(K("write-behind-max-entries"), 1000))
 
 # instantiate URL stations
 stations = {
@@ -31,14 +39,25 @@ stations = {
                         RTL2]}
 
 # add dynamic stations
-stations["Radio Pycolore"] = PycolorePlaylistStation(redis_repository)
+stations["Radio Pycolore"] = PycolorePlaylistStation(repository)
 
 
 # instantiate channels
+# ready-to-serve API responses are written if the API url is configured
+response_bodies = ResponseBodies.fromconfig(definitions)
+# current and next steps of all channels are also written in one document
+now_playing = NowPlaying(repository)
+# and in snapshot files served by the front proxy, if a directory is configured
+snapshots = None
+if (snapshots_directory := definitions.get(K("snapshots-directory"))) is not None:
+    snapshots = SnapshotPublisher([channel[K("id")] for channel in channels_definitions], snapshots_directory)
 channels = [
     Channel.fromconfig(
-        redis_repository,
+        repository,
         channel_definition,
         stations,
-        {})
+        {},
+        response_bodies,
+        now_playing,
+        snapshots)
     for channel_definition in channels_definitions]
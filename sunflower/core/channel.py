@@ -16,12 +16,17 @@ from sunflower.core.config import K
 from sunflower.core.custom_types import Step
 from sunflower.core.custom_types import StreamMetadata
 from sunflower.core.custom_types import UpdateInfo
+from sunflower.core.liquidsoap import generate_liquidsoap_config_for_channel
 from sunflower.core.liquidsoap import liquidsoap_telnet_session
+from sunflower.core.liquidsoap import send_command
 from sunflower.core.persistence import MetadataEncoder
 from sunflower.core.persistence import PersistenceMixin
 from sunflower.core.persistence import PersistentAttribute
-from sunflower.core.persistence import as_metadata_type
+from sunflower.core.publishers import NowPlaying
+from sunflower.core.publishers import SnapshotPublisher
 from sunflower.core.repository import Repository
+from sunflower.core.responses import ResponseBodies
+from sunflower.core.stations import STARTED_INPUT_STATUSES
 from sunflower.core.stations import Station
 from sunflower.core.timetable import Timetable
 from sunflower.handlers import Handler
@@ -43,19 +48,33 @@ class Channel(PersistenceMixin):
                  name: str,
                  repository: "Repository",
                  timetable: Timetable,
-                 handlers: Tuple[Type[Handler]] = ()):
+                 handlers: Tuple[Type[Handler]] = (),
+                 liquidsoap_timetable: bool = False,
+                 response_bodies: Optional[ResponseBodies] = None,
+                 now_playing: Optional[NowPlaying] = None,
+                 snapshots: Optional[SnapshotPublisher] = None):
         """Channel constructor.
 
         Parameters:
         - id: string
         - timetable: dict
         - handler: list of classes that can alter metadata and card metadata at channel level after fetching.
+        - liquidsoap_timetable: if True, timetable is compiled in liquidsoap config which switches stations
+          by itself, the scheduler only verifies the current station.
+        - response_bodies: if given, bodies of API responses are persisted with data (see ResponseBodies).
+        - now_playing: if given, current and next steps are also written in this document shared by channels.
+        - snapshots: if given, current and next steps are also written in snapshot files (see SnapshotPublisher).
         """
         super().__init__(repository, __id)
         self.name = name
         self.timetable = timetable
+        self.liquidsoap_timetable = liquidsoap_timetable
+        self.response_bodies = response_bodies
+        self.now_playing = now_playing
+        self.snapshots = snapshots
         self.handlers: Iterable[Handler] = [handler_cls(self) for handler_cls in handlers]
         self._liquidsoap_station: str = ""
+        self._stream_metadata: Optional[StreamMetadata] = None  # last metadata known by liquidsoap
         self._schedule_day: date = date(1970, 1, 1)
         self._last_pull = datetime.today()
         self.long_pull_interval = 10  # seconds between long pulls
@@ -65,12 +84,17 @@ class Channel(PersistenceMixin):
                    repository: "Repository",
                    config: Dict,
                    stations_map: Dict[str, Station],
-                   handlers_map: Dict[str, Type[Handler]]):
+                   handlers_map: Dict[str, Type[Handler]],
+                   response_bodies: Optional[ResponseBodies] = None,
+                   now_playing: Optional[NowPlaying] = None,
+                   snapshots: Optional[SnapshotPublisher] = None):
         channel_name = config[K("name")]
         channel_id = config[K("id")]
         channel_timetable = Timetable.fromconfig(config[K("timetable")], stations_map)
         channel_handlers = tuple(handlers_map[name] for name in config[K("handlers")])
-        return cls(channel_id, channel_name, repository, channel_timetable, channel_handlers)
+        liquidsoap_timetable = config.get(K("liquidsoap-timetable"), False)
+        return cls(channel_id, channel_name, repository, channel_timetable, channel_handlers, liquidsoap_timetable,
+                   response_bodies, now_playing, snapshots)
 
     @property
     def stations(self) -> tuple:
@@ -89,6 +113,10 @@ class Channel(PersistenceMixin):
         """Return next Station object to be on air."""
         return self.timetable.station_after(dt)
 
+    def get_liquidsoap_config(self) -> Tuple[str, str]:
+        """Return (sources, output) liquidsoap config strings of this channel."""
+        return generate_liquidsoap_config_for_channel(self)
+
     # noinspection PyMethodMayBeStatic
     def _post_get_hook_step(self, data: dict):
         try:
@@ -106,7 +134,6 @@ class Channel(PersistenceMixin):
         "current",
         "Current broadcast data",
         MetadataEncoder,
-        as_metadata_type,
         notify_change=True,
         post_get_hook=_post_get_hook_step,
         pre_set_hook=_pre_set_hook_step,
@@ -115,11 +142,10 @@ class Channel(PersistenceMixin):
         "next",
         "Next broadcast data",
         MetadataEncoder,
-        as_metadata_type,
         post_get_hook=_post_get_hook_step,
         pre_set_hook=_pre_set_hook_step,
     )
-    schedule = PersistentAttribute("schedule", "Schedule", MetadataEncoder, as_metadata_type)
+    schedule = PersistentAttribute("schedule", "Schedule", MetadataEncoder)
 
     @schedule.post_get_hook
     def schedule(self, data: List[Dict]):
@@ -127,7 +153,10 @@ class Channel(PersistenceMixin):
 
     @schedule.pre_set_hook
     def schedule(self, value: List[Step]):
-        return [step.dict() for step in value]
+        data = [step.dict() for step in value]
+        if self.response_bodies is not None:
+            self.response_bodies.persist_schedule(self, data)
+        return data
 
     def get_current_step(self, logger: Logger, now: datetime) -> UpdateInfo:
         """Get metadata of current broadcasted programm for current station.
@@ -175,20 +204,75 @@ class Channel(PersistenceMixin):
             for slot in self.timetable.resolved_timetable_of(datetime.today()))))
 
     def send_metadata_to_liquidsoap(self, stream_metadata: StreamMetadata, logger: Logger):
-        """Send stream metadata to liquidsoap."""
+        """Send stream metadata to liquidsoap.
+
+        Only fields different from the last metadata sent are updated: each update
+        makes liquidsoap emit new metadata to all listeners. Fields which did not
+        change are read first, since liquidsoap may have been restarted (for example
+        to reload its config) since they were sent.
+        """
         if stream_metadata is None:
             logger.debug(f"channel={self.id} StreamMetadata is empty")
             return
+        sent = True
         with liquidsoap_telnet_session() as session:
-            session.write(f'var.set {self.id}_artist = "{stream_metadata.artist}"\n'.encode())
-            session.read_until(b"\n")
-            session.write(f'var.set {self.id}_title = "{stream_metadata.title}"\n'.encode())
-            session.read_until(b"\n")
-            session.write(f'var.set {self.id}_album = "{stream_metadata.album}"\n'.encode())
-            session.read_until(b"\n")
+            for field in ("artist", "title", "album"):
+                value = getattr(stream_metadata, field)
+                if (self._stream_metadata is not None
+                        and getattr(self._stream_metadata, field) == value
+                        and send_command(session, f"var.get {self.id}_{field}") == f'"{value}"'):
+                    continue
+                answer = send_command(session, f'var.set {self.id}_{field} = "{value}"')
+                # an undefined variable is answered "Variable <name> is not defined."
+                sent = sent and " set (was " in answer
+        # if liquidsoap did not acknowledge, send everything again next time
+        self._stream_metadata = stream_metadata if sent else None
         logger.debug(f"channel={self.id} {stream_metadata} sent to liquidsoap")
         return
 
+    def reconcile_liquidsoap_state(self, logger: Logger, now: datetime, **context):
+        """Align liquidsoap switch variables with the timetable without blindly resending them.
+
+        Called once by the scheduler at startup: liquidsoap may still be running with
+        the right station enabled, so only variables having a wrong value are set.
+        Stream metadata currently known by liquidsoap is read too. If liquidsoap state
+        can't be read, nothing is assumed.
+        """
+        current_station_name = self.station_at(now).formatted_station_name
+        with liquidsoap_telnet_session() as session:
+            # with a compiled timetable, liquidsoap has no switch variables
+            if not self.liquidsoap_timetable:
+                for station_name in sorted(station.formatted_station_name for station in self.stations):
+                    variable = f"{station_name}_on_{self.id}"
+                    value = send_command(session, f"var.get {variable}")
+                    if value not in ("true", "false"):
+                        logger.warning(f"channel={self.id} Could not read {variable} in liquidsoap ({value!r}).")
+                        return
+                    should_be_on = station_name == current_station_name
+                    if (value == "true") != should_be_on:
+                        send_command(session, f"var.set {variable} = {'true' if should_be_on else 'false'}")
+            stream_metadata = {}
+            for field in ("artist", "title", "album"):
+                value = send_command(session, f"var.get {self.id}_{field}")
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    stream_metadata[field] = value[1:-1]
+            if len(stream_metadata) == 3:
+                self._stream_metadata = StreamMetadata(**stream_metadata)
+        self._liquidsoap_station = current_station_name
+        logger.debug(f"channel={self.id} station={current_station_name} Liquidsoap state reconciled.")
+
+    def _verify_liquidsoap_station(self, station: Station, logger: Logger):
+        """Check that station liquidsoap switched to is started (compiled timetable)."""
+        if not hasattr(station, "get_liquidsoap_source_status"):
+            return
+        status = station.get_liquidsoap_source_status()
+        if status.startswith(STARTED_INPUT_STATUSES):
+            return
+        logger.warning(
+            f"channel={self.id} station={station.formatted_station_name} "
+            f"Input is not started in liquidsoap ({status!r}), starting it.")
+        station.start_liquidsoap_source()
+
     def process(self, logger: Logger, now: datetime, **context):
         """If needed, update metadata.
 
@@ -217,12 +301,14 @@ class Channel(PersistenceMixin):
 
         # make sure current station is used by liquidsoap
         if (current_station_name := current_station.formatted_station_name) != self._liquidsoap_station:
-            with liquidsoap_telnet_session() as session:
-                session.write(f"var.set {current_station_name}_on_{self.id} = true\n".encode())
-                session.read_until(b"\n")
-                if self._liquidsoap_station:
-                    session.write(f"var.set {self._liquidsoap_station}_on_{self.id} = false\n".encode())
-                    session.read_until(b"\n")
+            if self.liquidsoap_timetable:
+                # liquidsoap already switched at the exact time, only verify
+                self._verify_liquidsoap_station(current_station, logger)
+            else:
+                with liquidsoap_telnet_session() as session:
+                    send_command(session, f"var.set {current_station_name}_on_{self.id} = true")
+                    if self._liquidsoap_station:
+                        send_command(session, f"var.set {self._liquidsoap_station}_on_{self.id} = false")
             self._liquidsoap_station = current_station_name
         # first retrieve current step
         current_step = self.current_step
@@ -239,10 +325,18 @@ class Channel(PersistenceMixin):
         should_notify, current_step = self.get_current_step(logger, now)
         if not should_notify:
             return
-        self.next_step = self.get_next_step(logger, datetime.fromtimestamp(current_step.end))
+        next_step = self.next_step = self.get_next_step(logger, datetime.fromtimestamp(current_step.end))
         # apply handlers if needed
         for handler in self.handlers:
             current_step = handler.process(current_step, logger, now)
+        # write response bodies, aggregated steps and snapshots before clients are notified of the update
+        current_step_data, next_step_data = self._pre_set_hook_step(current_step), self._pre_set_hook_step(next_step)
+        if self.response_bodies is not None:
+            self.response_bodies.persist_channel(self, current_step_data, next_step_data)
+        if self.now_playing is not None:
+            self.now_playing.update(self.id, current_step_data, next_step_data)
+        if self.snapshots is not None:
+            self.snapshots.update(self.id, current_step_data, next_step_data)
         # update metadata and info if needed
         self.current_step = current_step
         # update stream metadata
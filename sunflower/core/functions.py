@@ -1,24 +1,58 @@
 # This file is part of sunflower package. radio
 # This module contains core functions.
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import Optional
+
+
+class BackgroundEventLoop:
+    """Event loop running forever in a daemon thread.
+
+    Synchronous code submits coroutines with run() and waits for their results.
+    Contrary to asyncio.run(), the loop is created once: resources bound to it
+    (for example redis connection pools) are reused between calls. The loop is
+    started lazily, and started again in child processes after a fork.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="sunflower-event-loop", daemon=True).start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def run(self, coroutine_function, *args, **kwargs):
+        """Run coroutine in background loop and return its result."""
+        if not asyncio.iscoroutinefunction(coroutine_function):
+            raise TypeError('"coroutine_function" must be a coroutine_function.')
+        loop = self.loop
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            raise RuntimeError("Can't wait for a coroutine from the background loop itself.")
+        return asyncio.run_coroutine_threadsafe(coroutine_function(*args, **kwargs), loop).result()
+
+
+# loop shared by all synchronous code of the process
+background_loop = BackgroundEventLoop()
 
 
 def run_coroutine_synchronously(coroutine_function, *args, **kwargs):
     """Run coroutine syncronously.
 
-    Try to run asyncio.run. If it fails, run the coroutine in a
-    ThreadPoolExecutor.
+    The coroutine runs in the background loop shared by the process, so
+    calling this function does not create any event loop nor thread.
     """
-
-    if not asyncio.iscoroutinefunction(coroutine_function):
-        raise TypeError('"coroutine_function" must be a coroutine_function.')
-    try:
-        coro = coroutine_function(*args, **kwargs)
-        result = asyncio.run(coro)
-        return result
-    except:
-        coro = coroutine_function(*args, **kwargs)
-        with ThreadPoolExecutor() as executor:
-            result = executor.submit(asyncio.run, coro).result()
-            return result
+    return background_loop.run(coroutine_function, *args, **kwargs)
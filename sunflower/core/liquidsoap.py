@@ -1,6 +1,12 @@
+import contextlib
+import os
 import typing
 from contextlib import contextmanager
+from datetime import time
 from telnetlib import Telnet
+from typing import Iterable
+from typing import List
+from typing import Tuple
 from typing import Type
 
 from sunflower.core.config import K
@@ -9,64 +15,137 @@ from sunflower.core.config import get_config
 if typing.TYPE_CHECKING:
     from sunflower.core.channel import Channel
     from sunflower.core.stations import Station
-
-
-def write_liquidsoap_config(channels, filename):
-    """Write complete liquidsoap config file."""
-    with open("{}.liq".format(filename), "w") as f:
-        # config de base (log, activation server telnet, source par défaut)
-        f.write("#! /usr/bin/env liquidsoap\n\n")
-
-        f.write("# log file\n")
-        f.write('settings.log.file.set(true)\n')
-        f.write('settings.log.file.path.set("/tmp/sunflower.liquidsoap.log")\n')
-        f.write('settings.log.file.append.set(true)\n')
-        f.write('settings.log.stdout.set(false)\n\n')
-
-        f.write("# activate telnet server\n")
-        f.write('settings.server.telnet.set(true)\n\n')
-        f.write("# default source\n")
-        f.write('default = single("~/radio/franceinfo-long.ogg")\n\n')
-        
-        f.write("# streams\n")
-
-        # configuration des chaînes
-        # initialisation
-        used_stations = set()
-
-        # on récupère les infos de chaque chaîne
-        timetables = []
-        outputs = []
-        for channel in channels:
-            timetable, output = channel.get_liquidsoap_config()
-            timetables.append(timetable)
-            outputs.append(output)
-            used_stations.update(channel.stations)
-
-        # on commence par énumérer toutes les stations utilisées
-        for station in used_stations:
-            f.write(station.get_liquidsoap_config())
-
-        # puis on écrit les timetables
-        timetables_string = "\n".join(timetables)
-        f.write("\n" + timetables_string)
-
-        # et les output
-        outputs_string = "\n".join(outputs)
-        f.write("\n" + outputs_string)
-
-
-def generate_liquidsoap_config_for_channel(channel: "Channel"):
-    """Renvoie une chaîne de caractères à écrire dans le fichier de configuration liquidsoap."""
+    from sunflower.core.timetable import Timetable
+
+
+def render_liquidsoap_config(channels: Iterable["Channel"]) -> str:
+    """Return complete liquidsoap config script for given channels.
+
+    The script is deterministic: rendering the same channels with the same
+    config always gives the same string, so that unchanged configs can be
+    detected (see write_liquidsoap_config()).
+    """
+    config = get_config()
+    channels = list(channels)
+
+    # config de base (log, activation server telnet, source par défaut)
+    config_str = (
+        "#! /usr/bin/env liquidsoap\n\n"
+        "# log file\n"
+        "settings.log.file.set(true)\n"
+        'settings.log.file.path.set("/tmp/sunflower.liquidsoap.log")\n'
+        "settings.log.file.append.set(true)\n"
+        "settings.log.stdout.set(false)\n\n"
+        "# activate telnet server\n"
+        "settings.server.telnet.set(true)\n"
+        f'settings.server.telnet.port.set({config[K("liquidsoap-telnet-port")]})\n\n'
+        "# default source\n"
+        f'default = single("{config[K("liquidsoap-default-source")]}")\n\n'
+        "# streams\n")
+
+    # on commence par énumérer toutes les stations utilisées
+    used_stations = {station for channel in channels for station in channel.stations}
+    for station in sorted(used_stations, key=lambda station: station.formatted_station_name):
+        config_str += station.get_liquidsoap_config()
+
+    # puis on écrit les timetables et les outputs
+    timetables, outputs = [], []
+    for channel in channels:
+        timetable, output = channel.get_liquidsoap_config()
+        timetables.append(timetable)
+        outputs.append(output)
+    config_str += "\n" + "\n".join(timetables)
+    config_str += "\n" + "\n".join(outputs)
+    return config_str
+
+
+def write_liquidsoap_config(channels: Iterable["Channel"], filename: str) -> bool:
+    """Write complete liquidsoap config file if it changed.
+
+    The file is not touched if its content is already up to date, so liquidsoap
+    does not need to be restarted. Return True if the file was written.
+    """
+    config_str = render_liquidsoap_config(channels)
+    path = f"{filename}.liq"
+    with contextlib.suppress(FileNotFoundError):
+        with open(path) as f:
+            if f.read() == config_str:
+                return False
+    # write in a temporary file first so liquidsoap never reads a partial script
+    with open(f"{path}.tmp", "w") as f:
+        f.write(config_str)
+    os.replace(f"{path}.tmp", path)
+    return True
+
+
+def _liquidsoap_time(t: time) -> str:
+    """Format time as a liquidsoap time literal (for example 13h30m)."""
+    return f"{t.hour}h{t.minute}m" if t.minute else f"{t.hour}h"
+
+
+def _liquidsoap_weekdays(weekdays: Iterable[int]) -> str:
+    """Format python weekdays (monday is 0) as a liquidsoap predicate (monday is 1w).
+
+    Consecutive days are grouped in intervals: (0, 1, 2, 4) becomes "1w-3w or 5w".
+    """
+    runs: List[List[int]] = []
+    for weekday in sorted(weekdays):
+        if runs and runs[-1][-1] == weekday - 1:
+            runs[-1].append(weekday)
+        else:
+            runs.append([weekday])
+    return " or ".join(
+        f"{run[0] + 1}w" if len(run) == 1 else f"{run[0] + 1}w-{run[-1] + 1}w"
+        for run in runs)
+
+
+def compile_timetable(timetable: "Timetable") -> List[Tuple[str, "Station"]]:
+    """Compile timetable into (time predicate, station) liquidsoap switch clauses.
+
+    As in Timetable, a slot ending after midnight only applies to its own weekday:
+    after midnight, the timetable of the next day is used.
+    """
+    clauses = []
+    for weekdays, slots in timetable.weekdays_slots():
+        days_predicate = _liquidsoap_weekdays(weekdays)
+        if " or " in days_predicate:
+            days_predicate = f"({days_predicate})"
+        for slot in slots:
+            if slot.start == slot.end == time(0, 0):
+                predicate = days_predicate
+            else:
+                end = slot.end if slot.start < slot.end else time(0, 0)
+                predicate = f"{days_predicate} and {_liquidsoap_time(slot.start)}-{_liquidsoap_time(end)}"
+            clauses.append((f"{{{predicate}}}", slot.station))
+    return clauses
+
+
+def generate_liquidsoap_config_for_channel(channel: "Channel", compile_channel_timetable: bool = None):
+    """Renvoie une chaîne de caractères à écrire dans le fichier de configuration liquidsoap.
+
+    If compile_channel_timetable is True (default: channel.liquidsoap_timetable), the timetable
+    is compiled in time predicates and liquidsoap switches stations by itself. Otherwise the
+    scheduler switches stations with interactive variables.
+    """
+    if compile_channel_timetable is None:
+        compile_channel_timetable = channel.liquidsoap_timetable
+    # sort stations so that generated config is deterministic
+    stations = sorted(channel.stations, key=lambda station: station.formatted_station_name)
 
     # définition des horaires des radios
-    if channel.stations:
+    if channel.stations and compile_channel_timetable:
         source_str = f"# {channel.id} channel\n"
-        for station in channel.stations:
+        source_str += f"{channel.id}_radio = switch(track_sensitive=false, [\n"
+        for predicate, station in compile_timetable(channel.timetable):
+            source_str += f"    ({predicate}, {station.formatted_station_name}),\n"
+        source_str += "])\n"
+    elif channel.stations:
+        source_str = f"# {channel.id} channel\n"
+        for station in stations:
             station_name = station.formatted_station_name
             source_str += f'{station_name}_on_{channel.id} = interactive.bool("{station_name}_on_{channel.id}", false)\n'
         source_str += f"{channel.id}_radio = switch(track_sensitive=false, [\n"
-        for station in channel.stations:
+        for station in stations:
             station_name = station.formatted_station_name
             source_str += f"    ({station_name}_on_{channel.id}, {station_name}),\n"
         source_str += "])\n"
@@ -84,18 +163,19 @@ def generate_liquidsoap_config_for_channel(channel: "Channel"):
         f"end\n\n")
 
     # output
-    fallback = f"{channel.id}_radio" if source_str else channel.stations[0].formatted_station_name
-    source_str += f"{channel.id}_radio = fallback(track_sensitive=false, [{fallback}, default])\n"
+    source_str += f"{channel.id}_radio = fallback(track_sensitive=false, [{channel.id}_radio, default])\n"
     source_str += (
         f'{channel.id}_radio = fallback(track_sensitive=false, [request.queue(id='
-        f'"{channel.id}_custom_songs", {channel.id}_radio])\n')
+        f'"{channel.id}_custom_songs"), {channel.id}_radio])\n')
     source_str += (
         f'{channel.id}_radio = map_metadata(id="{channel.id}", '
         f'apply_{channel.id}_metadata, drop_metadata({channel.id}_radio))\n\n')
 
+    config = get_config()
     output_str = (
         f'output.icecast(%vorbis(quality=0.6),\n'
-        f'    host="localhost", port=3333, password="Arkelis77",\n'
+        f'    host="{config[K("icecast-host")]}", port={config[K("icecast-port")]}, '
+        f'password="{config[K("icecast-password")]}",\n'
         f'    mount="{channel.id}", {channel.id}_radio)\n\n')
 
     return source_str, output_str
@@ -106,12 +186,31 @@ def generate_liquidsoap_config_for_station(station: Type["Station"]):
             f'mksafe(input.http(id="{station.formatted_station_name}", start=false, "{station.station_url}"))\n')
 
 
+# seconds to wait for an answer of liquidsoap
+LIQUIDSOAP_TIMEOUT = 2
+# line ending each answer of liquidsoap
+LIQUIDSOAP_ANSWER_END = b"\r\nEND\r\n"
+
+
 class FakeSession:
+    """Session used when liquidsoap is not reachable: each command is answered with an error."""
+
     def write(self, *ars, **kwargs):
         pass
 
     def read_until(self, *args, **kwargs):
-        pass
+        return b"ERROR: liquidsoap is not reachable." + LIQUIDSOAP_ANSWER_END
+
+
+def send_command(session, command: str) -> str:
+    """Send command to liquidsoap and return its answer.
+
+    Liquidsoap ends each answer with a "END" line which is not included in
+    returned string (values in the answer may contain "END").
+    """
+    session.write(f"{command}\n".encode())
+    answer = session.read_until(LIQUIDSOAP_ANSWER_END, LIQUIDSOAP_TIMEOUT)
+    return answer.removesuffix(LIQUIDSOAP_ANSWER_END).decode().strip()
 
 
 @contextmanager
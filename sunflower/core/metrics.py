@@ -0,0 +1,132 @@
+# This file is part of sunflower package. radio
+# This module contains metrics of repositories.
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# upper bounds (seconds) of latency histogram buckets, a last bucket counts slower operations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def key_family(key: str) -> str:
+    """Return family of a repository key or channel, used to group metrics.
+
+    The "sunflower:" prefix is removed and channel ids and numbers are replaced
+    with "*": sunflower:channel:tournesol:current becomes channel:*:current,
+    sunflower:station:pycolore:playlist:flat:3 becomes station:pycolore:playlist:flat:*,
+    while sunflower:station:pycolore:playlist becomes station:pycolore:playlist.
+    """
+    parts = key.split(":")
+    if parts[0] == "sunflower":
+        parts = parts[1:]
+    if len(parts) >= 3 and parts[0] == "channel":
+        parts[1] = "*"
+    return ":".join("*" if part.isdigit() else part for part in parts)
+
+
+class OperationStats:
+    """Statistics of one operation on one key family."""
+    __slots__ = ("calls", "keys", "bytes", "seconds", "latency_counts")
+
+    def __init__(self):
+        self.calls = 0
+        self.keys = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, keys: int, size: int, seconds: float):
+        self.calls += 1
+        self.keys += keys
+        self.bytes += size
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_counts[i] += 1
+                break
+        else:
+            self.latency_counts[-1] += 1
+
+    def as_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "keys": self.keys,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "latency_counts": list(self.latency_counts),
+        }
+
+
+class Measure:
+    """Keys and payload sizes of an operation being measured (see RepositoryMetrics.measure())."""
+    __slots__ = ("sizes",)
+
+    def __init__(self):
+        # family -> [number of keys, bytes]
+        self.sizes: Dict[str, List[int]] = {}
+
+    def add(self, key: str, size: int = 0):
+        family_sizes = self.sizes.setdefault(key_family(key), [0, 0])
+        family_sizes[0] += 1
+        family_sizes[1] += size
+
+
+class RepositoryMetrics:
+    """Count operations, payload bytes and latency of repositories, by key family.
+
+    An operation involving keys of several families (for example retrieve_many())
+    counts one call for each family, with the latency of the whole round trip.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], OperationStats] = {}
+        self.since = datetime.now()
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[Measure]:
+        """Measure an operation; keys must be added to the yielded Measure with their size."""
+        measure = Measure()
+        start = time.perf_counter()
+        try:
+            yield measure
+        finally:
+            self.record(operation, measure, time.perf_counter() - start)
+
+    def record(self, operation: str, measure: Measure, seconds: float):
+        with self._lock:
+            for family, (keys, size) in measure.sizes.items():
+                stats = self._stats.get((operation, family))
+                if stats is None:
+                    stats = self._stats[(operation, family)] = OperationStats()
+                stats.record(keys, size, seconds)
+
+    def get(self, operation: str, family: str) -> Optional[OperationStats]:
+        return self._stats.get((operation, family))
+
+    def snapshot(self) -> Dict:
+        """Return jsonable statistics: {"families": {family: {operation: stats}}, ...}."""
+        with self._lock:
+            families: Dict[str, Dict] = {}
+            for (operation, family), stats in sorted(self._stats.items()):
+                families.setdefault(family, {})[operation] = stats.as_dict()
+        return {
+            "since": int(self.since.timestamp()),
+            "latency_buckets": list(LATENCY_BUCKETS),
+            "families": families,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.since = datetime.now()
+
+
+# metrics of repositories of this process
+repository_metrics = RepositoryMetrics()
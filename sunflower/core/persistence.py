@@ -3,7 +3,7 @@ from datetime import datetime
 from json.encoder import JSONEncoder
 from typing import Any
 from typing import Callable
-from typing import Dict
+from typing import List
 from typing import Optional
 from typing import Type
 
@@ -20,15 +20,6 @@ class MetadataEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def as_metadata_type(mapping: Dict[str, Any]) -> Dict[str, Any]:
-    """object_hook for supporting BroadcastType at json deserialization."""
-    for k, v in mapping.items():
-        if isinstance(v, BroadcastType):
-            mapping[k] = v.value
-            break
-    return mapping
-
-
 class PersistenceMixin:
     def __init_subclass__(cls, **kwargs):
         if not hasattr(cls, "data_type"):
@@ -40,17 +31,30 @@ class PersistenceMixin:
         self.id = __id
         super().__init__(*args, **kwargs)
 
+    def repository_key(self, key: str) -> str:
+        """Return full key of given key in repository."""
+        return f"sunflower:{self.data_type}:{self.id}:{key}"
+
     def retrieve_from_repository(self, key: str, object_hook: Optional[Callable] = None):
-        return self.repository.retrieve(
-            f"sunflower:{self.data_type}:{self.id}:{key}", object_hook)
+        return self.repository.retrieve(self.repository_key(key), object_hook)
+
+    def retrieve_many_from_repository(self, keys: List[str], object_hook: Optional[Callable] = None):
+        return self.repository.retrieve_many([self.repository_key(key) for key in keys], object_hook)
 
     def persist_to_repository(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
-        return self.repository.persist(
-            f"sunflower:{self.data_type}:{self.id}:{key}", value, json_encoder_cls)
+        return self.repository.persist(self.repository_key(key), value, json_encoder_cls)
 
     def publish_to_repository(self, channel, data):
-        return self.repository.publish(
-            f"sunflower:{self.data_type}:{self.id}:{channel}", data)
+        return self.repository.publish(self.repository_key(channel), data)
+
+    def persist_and_publish_to_repository(self,
+                                          key: str,
+                                          value: Any,
+                                          json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                                          channel,
+                                          data):
+        return self.repository.persist_and_publish(
+            self.repository_key(key), value, json_encoder_cls, self.repository_key(channel), data)
 
 
 
@@ -97,7 +101,7 @@ class PersistentAttribute:
             key: str = "",
             doc: str = "",
             json_encoder_cls: Type[JSONEncoder] = MetadataEncoder,
-            object_hook: Callable = as_metadata_type,
+            object_hook: Optional[Callable] = None,
             notify_change: bool = False,
             pre_set_hook: Callable = lambda self, x: x,
             post_get_hook: Callable = lambda self, x: x):
@@ -135,10 +139,12 @@ class PersistentAttribute:
         data = self.pre_set_hook_func(obj, value) if value is not None else value
         if self._cache == data:
             return
-        obj.persist_to_repository(self.key, data, self.json_encoder_cls)
-        self._cache = data
         if self.notify_change:
-            obj.publish_to_repository("updates", NotifyChangeStatus.UPDATED.value)
+            obj.persist_and_publish_to_repository(
+                self.key, data, self.json_encoder_cls, "updates", NotifyChangeStatus.UPDATED.value)
+        else:
+            obj.persist_to_repository(self.key, data, self.json_encoder_cls)
+        self._cache = data
 
     def __delete__(self, obj: PersistenceMixin):
         raise AttributeError(f"Can't delete attribute 'f{self.name}'.")
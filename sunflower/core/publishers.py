@@ -0,0 +1,132 @@
+# This file is part of sunflower package. radio
+# This module contains objects publishing data of the scheduler process.
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+from logging import Logger
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+from sunflower.core.metrics import RepositoryMetrics
+from sunflower.core.metrics import repository_metrics
+from sunflower.core.custom_types import NotifyChangeStatus
+from sunflower.core.persistence import MetadataEncoder
+from sunflower.core.persistence import PersistenceMixin
+from sunflower.core.persistence import PersistentAttribute
+from sunflower.core.repository import Repository
+from sunflower.core.responses import render_json
+
+
+class MetricsPublisher(PersistenceMixin):
+    """Persist a snapshot of repository metrics every interval seconds.
+
+    Snapshots are stored in sunflower:metrics:<id>:repository (see
+    RepositoryMetrics.snapshot()). Like stations, publishers are processed
+    by the scheduler at each iteration.
+    """
+    data_type = "metrics"
+    snapshot = PersistentAttribute("repository", "Snapshot of repository metrics")
+
+    def __init__(self,
+                 repository: Repository,
+                 id: str = "scheduler",
+                 metrics: Optional[RepositoryMetrics] = None,
+                 interval: float = 60):
+        super().__init__(repository, id)
+        self.metrics = metrics or repository_metrics
+        self.interval = interval
+        self._last_publication: Optional[datetime] = None
+
+    def process(self, logger: Logger, now: datetime, **kwargs):
+        if self._last_publication is not None and (now - self._last_publication).total_seconds() < self.interval:
+            return
+        self._last_publication = now
+        self.snapshot = self.metrics.snapshot()
+
+
+def write_file_atomically(path: str, data: bytes, mtime: float):
+    """Write data in a temporary file, set its mtime and rename it to path.
+
+    Readers of path see the old or the new content, never a partial one.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.utime(temporary_path, (mtime, mtime))
+    os.replace(temporary_path, path)
+
+
+class SnapshotPublisher:
+    """Write now-playing snapshots of channels in files, served by the front proxy.
+
+    <directory>/<channel id>.json contains the current and next steps of a
+    channel, and <directory>/index.json the list of snapshots of all channels
+    (in the order of channels_ids). Channels call update() with their steps
+    when they change (see Channel.process()), and files are rewritten
+    (atomically) only if the snapshot changed. The mtime of a snapshot is the
+    start of its current step (the latest one for the index), so that
+    Last-Modified headers match step boundaries.
+
+    Snapshots written before a restart of the scheduler are read back, so the
+    index keeps channels not updated since.
+    """
+
+    def __init__(self, channels_ids: Iterable[str], directory: str):
+        self.channels_ids = list(channels_ids)
+        self.directory = directory
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        os.makedirs(directory, exist_ok=True)
+        for channel_id in self.channels_ids:
+            with contextlib.suppress(OSError, ValueError):
+                with open(self._path(channel_id), "rb") as f:
+                    self._snapshots[channel_id] = json.loads(f.read())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    @staticmethod
+    def _mtime(snapshot: Dict[str, Any]) -> Optional[float]:
+        return (snapshot["current_step"] or {}).get("start")
+
+    def update(self, channel_id: str, current_step: Optional[Dict], next_step: Optional[Dict]):
+        """Write snapshot of a channel with given steps data, and the index, if it changed."""
+        snapshot = {"id": channel_id, "current_step": current_step, "next_step": next_step}
+        if self._snapshots.get(channel_id) == snapshot:
+            return
+        mtime = self._mtime(snapshot) or time.time()
+        write_file_atomically(self._path(channel_id), render_json(snapshot), mtime)
+        self._snapshots[channel_id] = snapshot
+        snapshots = [self._snapshots[id_] for id_ in self.channels_ids if id_ in self._snapshots]
+        index_mtime = max((self._mtime(snapshot) or 0 for snapshot in snapshots), default=0) or mtime
+        write_file_atomically(self._path("index"), render_json(snapshots), index_mtime)
+
+
+class NowPlaying(PersistenceMixin):
+    """Current and next steps of all channels, in one key per channel.
+
+    Channels update their entry before publishing their own update, so entries
+    are up to date when clients are notified. The entry of a channel is stored
+    in sunflower:now-playing:all:steps:<channel id> as {"current_step": ...,
+    "next_step": ...} (one field of the sunflower:now-playing:all hash with
+    RedisRepository), so channels never overwrite each other's entries and the
+    server reads all of them at once. Changes are published in the updates
+    channel.
+    """
+    data_type = "now-playing"
+
+    def __init__(self, repository: Repository, id: str = "all"):
+        super().__init__(repository, id)
+        self._steps: Dict[str, Dict[str, Any]] = {}
+
+    def update(self, channel_id: str, current_step: Optional[Dict], next_step: Optional[Dict]):
+        """Set steps of a channel and persist its entry if it changed."""
+        steps = {"current_step": current_step, "next_step": next_step}
+        if self._steps.get(channel_id) == steps:
+            return
+        self.persist_and_publish_to_repository(
+            f"steps:{channel_id}", steps, MetadataEncoder, "updates", NotifyChangeStatus.UPDATED.value)
+        self._steps[channel_id] = steps
@@ -1,13 +1,35 @@
+import asyncio
+import base64
 import json
+import os
+import sqlite3
+import threading
+import time
 from abc import ABC
 from abc import abstractmethod
+from collections import deque
+from contextlib import contextmanager
 from typing import Any
 from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Type
+from typing import Union
 
 import aredis
-from sunflower.core.functions import run_coroutine_synchronously
+from sunflower.core import serializers
+from sunflower.core.config import K
+from sunflower.core.functions import BackgroundEventLoop
+from sunflower.core.functions import background_loop
+from sunflower.core.metrics import RepositoryMetrics
+from sunflower.core.metrics import repository_metrics
+from sunflower.core.serializers import JSONSerializer
+from sunflower.core.serializers import Serializer
+from sunflower.core.serializers import get_serializer
 
 
 class Repository(ABC):
@@ -20,41 +42,234 @@ class Repository(ABC):
         ...
 
     @abstractmethod
-    def publish(self, key: str, channel, data):
+    def publish(self, channel, data):
         ...
 
+    def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys (None for missing keys).
 
-class RedisRepository(Repository):
-    """Provide a method to access data from redis database.
+        Implementations should override it to fetch all keys at once.
+        """
+        return [self.retrieve(key, object_hook) for key in keys]
+
+    def persist_and_publish(self,
+                            key: str,
+                            value: Any,
+                            json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                            channel,
+                            data):
+        """Persist value and publish a message about it.
+
+        Implementations should override it to do both atomically.
+        """
+        self.persist(key, value, json_encoder_cls)
+        self.publish(channel, data)
+
+
+class AsyncRepository(ABC):
+    """Counterpart of Repository for coroutines (for example in API endpoints)."""
+
+    @abstractmethod
+    async def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        ...
+
+    @abstractmethod
+    async def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        ...
+
+    @abstractmethod
+    async def publish(self, channel, data):
+        ...
+
+    async def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys (None for missing keys).
+
+        Implementations should override it to fetch all keys at once.
+        """
+        return [await self.retrieve(key, object_hook) for key in keys]
+
+    async def persist_and_publish(self,
+                                  key: str,
+                                  value: Any,
+                                  json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                                  channel,
+                                  data):
+        """Persist value and publish a message about it.
+
+        Implementations should override it to do both atomically.
+        """
+        await self.persist(key, value, json_encoder_cls)
+        await self.publish(channel, data)
+
+    async def update_log_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        """Return ids of first and last messages of the update log (None if it is empty).
+
+        Published messages are also appended to a bounded log with increasing
+        ids, so that missed messages can be read again (see read_updates()).
+        """
+        raise NotImplementedError
+
+    async def read_updates(self, after_id: str, timeout: float = 0) -> List[Tuple[str, str, bytes]]:
+        """Return (id, channel, data) of logged messages published after after_id.
+
+        If there is none yet, wait at most timeout seconds for new ones.
+        """
+        raise NotImplementedError
+
+
+def update_id_key(update_id: str) -> Tuple[int, ...]:
+    """Return sortable key of an update log id ("1526919030474-55" with redis, "42" with SQLite)."""
+    return tuple(int(part) for part in update_id.split("-"))
+
+
+def update_id_time(update_id: str) -> Optional[float]:
+    """Return publication timestamp held by an update log id (only redis ids hold one), or None."""
+    milliseconds, separator, _ = update_id.partition("-")
+    return int(milliseconds) / 1000 if separator else None
+
+
+class AsyncRedisRepository(AsyncRepository):
+    """Provide coroutines to access data from redis database.
 
-    Define REDIS_KEYS containing keys the application has right
-    to access.
+    The redis client (and its connection pool) is created at first use, once
+    per process: all coroutines of a server worker share the same connections.
+
+    Two key layouts are supported:
+
+    - by default, each key is a redis string holding json (for example
+      `sunflower:channel:tournesol:current`);
+    - with hash_layout=True, each object has one redis hash
+      (`sunflower:<type>:<id>`) and the rest of a key is one of its fields
+      (field `current` of hash `sunflower:channel:tournesol`, field
+      `playlist:flat:0` of hash `sunflower:station:pycolore`). Each write also
+      increments the `version` field of the hash, which can be retrieved like
+      other fields. If a field is missing, the string key is read instead, so
+      data written with the previous layout is still readable during migration
+      (servers must be switched to the hash layout before the scheduler).
+
+    Values are written with given serializer (json by default). Values written
+    by binary serializers carry a format tag, so values of any format can be
+    read whatever the serializer: servers and scheduler can be switched to
+    another serializer one after the other.
+    Bytes values are stored as is (see serializers.dumps()).
+
+    Operations are counted in metrics (by default, metrics of the process).
+
+    Published messages are also appended to the sunflower:updates stream,
+    capped to about max_updates entries (see read_updates()).
     """
-    __slots__ = ("_redis",)
+    __slots__ = ("_redis", "_pid", "hash_layout", "serializer", "metrics", "max_updates")
 
-    def __init__(self, *args, **kwargs):
-        self._redis = aredis.StrictRedis()
+    update_log_key = "sunflower:updates"
 
-    def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+    def __init__(self,
+                 *args,
+                 hash_layout: bool = False,
+                 serializer: Optional[Serializer] = None,
+                 metrics: Optional[RepositoryMetrics] = None,
+                 max_updates: int = 1000,
+                 **kwargs):
+        self._redis: Optional[aredis.StrictRedis] = None
+        self._pid: Optional[int] = None
+        self.hash_layout = hash_layout
+        self.serializer = serializer or JSONSerializer()
+        self.metrics = metrics or repository_metrics
+        self.max_updates = max_updates
+
+    @property
+    def redis(self) -> aredis.StrictRedis:
+        if self._redis is None or self._pid != os.getpid():
+            self._redis = aredis.StrictRedis()
+            self._pid = os.getpid()
+        return self._redis
+
+    @staticmethod
+    def _hash_and_field(key: str) -> Tuple[str, str]:
+        """Return hash of the object of key (sunflower:<type>:<id>) and field (rest of the key)."""
+        parts = key.split(":", 3)
+        if len(parts) < 4:
+            raise ValueError(f"Key {key!r} does not belong to an object (sunflower:<type>:<id>:<key>).")
+        return ":".join(parts[:3]), parts[3]
+
+    @staticmethod
+    def _loads(raw_data: Optional[bytes], object_hook: Optional[Callable]):
+        if raw_data is None:
+            return None
+        return serializers.loads(raw_data, object_hook)
+
+    async def retrieve(self, key: str, object_hook: Optional[Callable] = None):
         """Get value for given key from Redis.
 
-        Data got from Redis is loaded from json with given object_hook.
+        Data got from Redis is decoded with given object_hook, whatever its format.
         If no data is found, return None.
         """
-        raw_data = run_coroutine_synchronously(self._redis.get, key)
-        if raw_data is None:
-            return None
-        return json.loads(raw_data.decode(), object_hook=object_hook)
+        with self.metrics.measure("retrieve") as measure:
+            raw_data = None
+            if self.hash_layout:
+                raw_data = await self.redis.hget(*self._hash_and_field(key))
+            if raw_data is None:
+                raw_data = await self.redis.get(key)
+            measure.add(key, len(raw_data or b""))
+            return self._loads(raw_data, object_hook)
 
-    def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+    async def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys in one round trip (see retrieve()).
+
+        With the hash layout, fields of a same hash are read with one HMGET.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        with self.metrics.measure("retrieve_many") as measure:
+            if self.hash_layout:
+                raw_data_list = await self._retrieve_many_from_hashes(keys)
+            else:
+                raw_data_list = await self.redis.mget(keys)
+            for key, raw_data in zip(keys, raw_data_list):
+                measure.add(key, len(raw_data or b""))
+            return [self._loads(raw_data, object_hook) for raw_data in raw_data_list]
+
+    async def _retrieve_many_from_hashes(self, keys: List[str]) -> List[Optional[bytes]]:
+        fields_by_hash: Dict[str, List[str]] = {}
+        for key in keys:
+            hash_key, field = self._hash_and_field(key)
+            fields_by_hash.setdefault(hash_key, []).append(field)
+        async with await self.redis.pipeline(transaction=False) as pipeline:
+            for hash_key, fields in fields_by_hash.items():
+                await pipeline.hmget(hash_key, fields)
+            await pipeline.mget(keys)
+            *hashes_values, legacy_values = await pipeline.execute()
+        raw_data_by_key = {
+            f"{hash_key}:{field}": raw_data
+            for hash_key, values in zip(fields_by_hash, hashes_values)
+            for field, raw_data in zip(fields_by_hash[hash_key], values)}
+        return [
+            raw_data_by_key[key] if raw_data_by_key[key] is not None else legacy_raw_data
+            for key, legacy_raw_data in zip(keys, legacy_values)]
+
+    async def _queue_persist(self, pipeline, key: str, raw_data: bytes):
+        if self.hash_layout:
+            hash_key, field = self._hash_and_field(key)
+            await pipeline.hset(hash_key, field, raw_data)
+            await pipeline.hincrby(hash_key, "version", 1)
+        else:
+            await pipeline.set(key, raw_data)
+
+    async def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
         """Set new value for given key in Redis.
 
-        value is dumped as json with given json_encoder_cls.
+        value is dumped by the serializer with given json_encoder_cls.
         """
-        json_data = json.dumps(value, cls=json_encoder_cls)
-        return run_coroutine_synchronously(self._redis.set, key, json_data)
+        with self.metrics.measure("persist") as measure:
+            raw_data = serializers.dumps(self.serializer, value, json_encoder_cls)
+            measure.add(key, len(raw_data))
+            if not self.hash_layout:
+                return await self.redis.set(key, raw_data)
+            async with await self.redis.pipeline(transaction=True) as pipeline:
+                await self._queue_persist(pipeline, key, raw_data)
+                return (await pipeline.execute())[0]
 
-    def publish(self, channel, data):
+    async def publish(self, channel, data):
         """publish a message to a redis channel.
 
         Parameters:
@@ -63,6 +278,478 @@ class RedisRepository(Repository):
 
         channel in redis is prefixed with 'sunflower:'.
         """
-        if not isinstance(data, str):
-            data = json.dumps(data)
-        run_coroutine_synchronously(self._redis.publish, channel, data)
+        with self.metrics.measure("publish") as measure:
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            measure.add(channel, len(data))
+            async with await self.redis.pipeline(transaction=True) as pipeline:
+                await self._queue_publish(pipeline, channel, data)
+                await pipeline.execute()
+
+    async def persist_and_publish(self,
+                                  key: str,
+                                  value: Any,
+                                  json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                                  channel,
+                                  data):
+        """Persist value and publish a message in one transaction (see persist() and publish())."""
+        with self.metrics.measure("persist_and_publish") as measure:
+            raw_data = serializers.dumps(self.serializer, value, json_encoder_cls)
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            measure.add(key, len(raw_data))
+            measure.add(channel, len(data))
+            async with await self.redis.pipeline(transaction=True) as pipeline:
+                await self._queue_persist(pipeline, key, raw_data)
+                await self._queue_publish(pipeline, channel, data)
+                await pipeline.execute()
+
+    async def _queue_publish(self, pipeline, channel: str, data: str):
+        await pipeline.publish(channel, data)
+        await pipeline.execute_command(
+            "XADD", self.update_log_key, "MAXLEN", "~", self.max_updates, "*", "channel", channel, "data", data)
+
+    # lowercase command names skip aredis response callbacks, which mix up fields of stream entries
+
+    async def update_log_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        async with await self.redis.pipeline(transaction=False) as pipeline:
+            await pipeline.execute_command("xrange", self.update_log_key, "-", "+", "COUNT", 1)
+            await pipeline.execute_command("xrevrange", self.update_log_key, "+", "-", "COUNT", 1)
+            first_entries, last_entries = await pipeline.execute()
+        if not first_entries:
+            return None, None
+        return first_entries[0][0].decode(), last_entries[0][0].decode()
+
+    async def read_updates(self, after_id: str, timeout: float = 0) -> List[Tuple[str, str, bytes]]:
+        """Read entries of the update log after after_id (see AsyncRepository.read_updates())."""
+        block = ("BLOCK", max(int(timeout * 1000), 1)) if timeout > 0 else ()
+        response = await self.redis.execute_command(
+            "xread", *block, "COUNT", self.max_updates, "STREAMS", self.update_log_key, after_id)
+        updates = []
+        for _, entries in response or ():
+            for update_id, fields in entries:
+                fields = dict(zip(fields[::2], fields[1::2]))
+                updates.append((update_id.decode(), fields[b"channel"].decode(), fields[b"data"]))
+        return updates
+
+
+class RedisRepository(Repository):
+    """Provide a method to access data from redis database.
+
+    Coroutines of AsyncRedisRepository are run in a background event loop
+    living as long as the process (shared by default), so connections of the
+    pool are reused between calls.
+    """
+    __slots__ = ("_async_repository", "_loop")
+
+    def __init__(self, *args, loop: Optional[BackgroundEventLoop] = None, **kwargs):
+        self._async_repository = AsyncRedisRepository(*args, **kwargs)
+        self._loop = loop or background_loop
+
+    def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        """Get value for given key from Redis (see AsyncRedisRepository.retrieve())."""
+        return self._loop.run(self._async_repository.retrieve, key, object_hook)
+
+    def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys with one MGET (see AsyncRedisRepository.retrieve_many())."""
+        return self._loop.run(self._async_repository.retrieve_many, keys, object_hook)
+
+    def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        """Set new value for given key in Redis (see AsyncRedisRepository.persist())."""
+        return self._loop.run(self._async_repository.persist, key, value, json_encoder_cls)
+
+    def publish(self, channel, data):
+        """Publish a message to a redis channel (see AsyncRedisRepository.publish())."""
+        self._loop.run(self._async_repository.publish, channel, data)
+
+    def persist_and_publish(self,
+                            key: str,
+                            value: Any,
+                            json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                            channel,
+                            data):
+        """Persist value and publish a message in one transaction (see AsyncRedisRepository)."""
+        self._loop.run(self._async_repository.persist_and_publish, key, value, json_encoder_cls, channel, data)
+
+
+class SQLiteRepository(Repository):
+    """Store data in an embedded SQLite database, for single-node deployments without redis.
+
+    The database is in WAL mode: server workers (other processes) read while the
+    scheduler writes. Each thread of each process has its own connection.
+
+    Messages are appended to a table which the server polls (see
+    AsyncSQLiteRepository.read_updates()); only the last max_messages messages
+    are kept.
+
+    Operations are counted in metrics (by default, metrics of the process).
+    """
+    __slots__ = ("path", "serializer", "max_messages", "metrics", "_local", "_pid")
+
+    def __init__(self,
+                 path: str = "sunflower.sqlite3",
+                 serializer: Optional[Serializer] = None,
+                 max_messages: int = 1000,
+                 metrics: Optional[RepositoryMetrics] = None):
+        self.path = path
+        self.serializer = serializer or JSONSerializer()
+        self.max_messages = max_messages
+        self.metrics = metrics or repository_metrics
+        self._local = threading.local()
+        self._pid: Optional[int] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None: autocommit, transactions are explicit (see _transaction())
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS messages "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, data TEXT NOT NULL)")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        """Get value for given key, decoded with given object_hook (None if missing)."""
+        with self.metrics.measure("retrieve") as measure:
+            row = self.connection.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            measure.add(key, len(row[0]) if row is not None else 0)
+            if row is None:
+                return None
+            return serializers.loads(row[0], object_hook)
+
+    def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        """Get values of several keys with one query (see retrieve())."""
+        keys = list(keys)
+        raw_data_by_key = {}
+        with self.metrics.measure("retrieve_many") as measure:
+            # stay below the maximum number of parameters of old SQLite versions
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                raw_data_by_key.update(self.connection.execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({', '.join('?' * len(chunk))})", chunk))
+            for key in keys:
+                measure.add(key, len(raw_data_by_key.get(key, b"")))
+            return [
+                serializers.loads(raw_data_by_key[key], object_hook) if key in raw_data_by_key else None
+                for key in keys]
+
+    def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        """Set new value for given key, dumped by the serializer with given json_encoder_cls."""
+        with self.metrics.measure("persist") as measure:
+            raw_data = serializers.dumps(self.serializer, value, json_encoder_cls)
+            measure.add(key, len(raw_data))
+            self.connection.execute("REPLACE INTO kv (key, value) VALUES (?, ?)", (key, raw_data))
+
+    def _insert_message(self, connection: sqlite3.Connection, channel, data: str):
+        message_id = connection.execute("INSERT INTO messages (channel, data) VALUES (?, ?)", (channel, data)).lastrowid
+        connection.execute("DELETE FROM messages WHERE id <= ?", (message_id - self.max_messages,))
+
+    def publish(self, channel, data):
+        """Publish a message (jsonable data or str) to subscribers of channel."""
+        with self.metrics.measure("publish") as measure:
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            measure.add(channel, len(data))
+            with self._transaction() as connection:
+                self._insert_message(connection, channel, data)
+
+    def persist_and_publish(self,
+                            key: str,
+                            value: Any,
+                            json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                            channel,
+                            data):
+        """Persist value and publish a message in one transaction (see persist() and publish())."""
+        with self.metrics.measure("persist_and_publish") as measure:
+            raw_data = serializers.dumps(self.serializer, value, json_encoder_cls)
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            measure.add(key, len(raw_data))
+            measure.add(channel, len(data))
+            with self._transaction() as connection:
+                connection.execute("REPLACE INTO kv (key, value) VALUES (?, ?)", (key, raw_data))
+                self._insert_message(connection, channel, data)
+
+    def messages_since(self, message_id: int, channels: Optional[Iterable[str]] = None) -> List[Tuple[int, str, str]]:
+        """Return (id, channel, data) of messages published to given channels (default: all) after message_id."""
+        if channels is None:
+            return self.connection.execute(
+                "SELECT id, channel, data FROM messages WHERE id > ? ORDER BY id", (message_id,)).fetchall()
+        channels = list(channels)
+        return self.connection.execute(
+            f"SELECT id, channel, data FROM messages WHERE id > ? AND channel IN ({', '.join('?' * len(channels))}) "
+            f"ORDER BY id", (message_id, *channels)).fetchall()
+
+    def messages_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        """Return ids of first and last kept messages (None if there is none)."""
+        return self.connection.execute("SELECT MIN(id), MAX(id) FROM messages").fetchone()
+
+
+class AsyncSQLiteRepository(AsyncRepository):
+    """Provide coroutines to access a SQLite repository (see SQLiteRepository).
+
+    Queries are run in threads so that they never block the event loop.
+    """
+    __slots__ = ("_repository",)
+
+    def __init__(self, *args, **kwargs):
+        self._repository = SQLiteRepository(*args, **kwargs)
+
+    async def update_log_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        """Return ids of first and last kept messages, which are the update log."""
+        first_id, last_id = await asyncio.to_thread(self._repository.messages_bounds)
+        if first_id is None:
+            return None, None
+        return str(first_id), str(last_id)
+
+    async def read_updates(self, after_id: str, timeout: float = 0,
+                           poll_interval: float = 0.05) -> List[Tuple[str, str, bytes]]:
+        """Read kept messages after after_id, polling for new ones during timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            messages = await asyncio.to_thread(self._repository.messages_since, int(after_id))
+            if messages or time.monotonic() >= deadline:
+                return [(str(message_id), channel, data.encode()) for message_id, channel, data in messages]
+            await asyncio.sleep(poll_interval)
+
+    async def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        return await asyncio.to_thread(self._repository.retrieve, key, object_hook)
+
+    async def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        return await asyncio.to_thread(self._repository.retrieve_many, list(keys), object_hook)
+
+    async def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        return await asyncio.to_thread(self._repository.persist, key, value, json_encoder_cls)
+
+    async def publish(self, channel, data):
+        await asyncio.to_thread(self._repository.publish, channel, data)
+
+    async def persist_and_publish(self,
+                                  key: str,
+                                  value: Any,
+                                  json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                                  channel,
+                                  data):
+        await asyncio.to_thread(
+            self._repository.persist_and_publish, key, value, json_encoder_cls, channel, data)
+
+
+# errors meaning that a repository is (maybe briefly) unavailable
+UNAVAILABLE_REPOSITORY_ERRORS = (
+    OSError,  # including ConnectionError
+    asyncio.TimeoutError,
+    aredis.exceptions.ConnectionError,
+    aredis.exceptions.TimeoutError,
+    sqlite3.OperationalError,
+)
+
+
+class WriteBehindRepository(Repository):
+    """Buffer writes in a journal while a repository is unavailable.
+
+    While the repository is available, writes are passed to it as is. Persists
+    and publishes failing with one of UNAVAILABLE_REPOSITORY_ERRORS are
+    appended to a journal instead of raising, and are replayed in order once the
+    repository is back (at most every retry_interval seconds, before any other
+    operation). While the journal is not empty, new writes are appended to it
+    so that order is kept.
+
+    Values are read from the journal if they are there, so the scheduler reads
+    its own writes during an outage and does not fetch them again. If the
+    repository is unavailable, other keys get the last value read or written
+    by this process (written values are decoded like journaled ones); reading
+    a key never read nor written still raises.
+
+    Bytes values are journaled in base64.
+
+    The journal keeps only the last write of each key and at most max_entries
+    entries (the oldest are dropped). If path is given, the journal is also
+    written to this file (one json entry per line), and reloaded at startup.
+    """
+
+    def __init__(self,
+                 repository: Repository,
+                 path: Optional[str] = None,
+                 max_entries: int = 1000,
+                 retry_interval: float = 1):
+        self.repository = repository
+        self.path = path
+        self.max_entries = max_entries
+        self.retry_interval = retry_interval
+        self.dropped_entries = 0
+        self._journal: Deque[Dict[str, Any]] = deque()
+        self._last_attempt = 0.0
+        # key -> (written, value, json_encoder_cls): last value read or written, served during outages
+        self._last_values: Dict[str, Tuple[bool, Any, Optional[Type[json.JSONEncoder]]]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._journal.extend(json.loads(line) for line in f if line.strip())
+
+    def __len__(self):
+        return len(self._journal)
+
+    def _save(self):
+        if self.path is None:
+            return
+        # write in a temporary file first so the journal is never partially written
+        with open(f"{self.path}.tmp", "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in self._journal)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def _append(self, entry: Dict[str, Any]):
+        if "key" in entry:
+            # only the last value of a key matters, but messages are kept
+            journal: Deque[Dict[str, Any]] = deque()
+            for old_entry in self._journal:
+                if old_entry.get("key") != entry["key"]:
+                    journal.append(old_entry)
+                elif old_entry["operation"] == "persist_and_publish":
+                    journal.append({
+                        "operation": "publish", "channel": old_entry["channel"], "message": old_entry["message"]})
+            self._journal = journal
+        self._journal.append(entry)
+        while len(self._journal) > self.max_entries:
+            self._journal.popleft()
+            self.dropped_entries += 1
+        self._save()
+
+    @staticmethod
+    def _entry_data(value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]]) -> Dict[str, str]:
+        if isinstance(value, bytes):
+            return {"raw_data": base64.b64encode(value).decode()}
+        return {"data": json.dumps(value, cls=json_encoder_cls)}
+
+    @staticmethod
+    def _entry_value(entry: Dict[str, Any], object_hook: Optional[Callable] = None):
+        if "raw_data" in entry:
+            return base64.b64decode(entry["raw_data"])
+        return json.loads(entry["data"], object_hook=object_hook)
+
+    def _replay(self, entry: Dict[str, Any]):
+        operation = entry["operation"]
+        if operation == "persist":
+            self.repository.persist(entry["key"], self._entry_value(entry))
+        elif operation == "publish":
+            self.repository.publish(entry["channel"], entry["message"])
+        else:
+            self.repository.persist_and_publish(
+                entry["key"], self._entry_value(entry), None, entry["channel"], entry["message"])
+
+    def flush(self, force: bool = False) -> bool:
+        """Replay journal in order, return True if it is empty.
+
+        Unless force is True, nothing is tried if last attempt is recent.
+        """
+        if not self._journal:
+            return True
+        if not force and time.monotonic() - self._last_attempt < self.retry_interval:
+            return False
+        self._last_attempt = time.monotonic()
+        try:
+            while self._journal:
+                self._replay(self._journal[0])
+                self._journal.popleft()
+        except UNAVAILABLE_REPOSITORY_ERRORS:
+            return False
+        finally:
+            self._save()
+        return True
+
+    def _write(self, write: Callable[[], Any], entry: Callable[[], Dict[str, Any]]):
+        """Call write() if the journal is empty, else (or if it fails) journal entry()."""
+        if self.flush():
+            try:
+                return write()
+            except UNAVAILABLE_REPOSITORY_ERRORS:
+                self._last_attempt = time.monotonic()
+        self._append(entry())
+
+    def _last_value(self, key: str, object_hook: Optional[Callable]):
+        written, value, json_encoder_cls = self._last_values[key]
+        if written:
+            return self._entry_value(self._entry_data(value, json_encoder_cls), object_hook)
+        return value
+
+    def retrieve(self, key: str, object_hook: Optional[Callable] = None):
+        return self.retrieve_many([key], object_hook)[0]
+
+    def retrieve_many(self, keys: Iterable[str], object_hook: Optional[Callable] = None) -> List[Any]:
+        keys = list(keys)
+        self.flush()
+        journaled_entries = {entry["key"]: entry for entry in self._journal if "key" in entry}
+        other_keys = [key for key in keys if key not in journaled_entries]
+        try:
+            values = dict(zip(other_keys, self.repository.retrieve_many(other_keys, object_hook)))
+        except UNAVAILABLE_REPOSITORY_ERRORS:
+            if any(key not in self._last_values for key in other_keys):
+                raise
+            values = {key: self._last_value(key, object_hook) for key in other_keys}
+        else:
+            for key, value in values.items():
+                self._last_values[key] = (False, value, None)
+        return [
+            self._entry_value(journaled_entries[key], object_hook) if key in journaled_entries else values[key]
+            for key in keys]
+
+    def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
+        self._last_values[key] = (True, value, json_encoder_cls)
+        self._write(
+            lambda: self.repository.persist(key, value, json_encoder_cls),
+            lambda: {"operation": "persist", "key": key, **self._entry_data(value, json_encoder_cls)})
+
+    def publish(self, channel, data):
+        self._write(
+            lambda: self.repository.publish(channel, data),
+            lambda: {"operation": "publish", "channel": channel, "message": data})
+
+    def persist_and_publish(self,
+                            key: str,
+                            value: Any,
+                            json_encoder_cls: Optional[Type[json.JSONEncoder]],
+                            channel,
+                            data):
+        self._last_values[key] = (True, value, json_encoder_cls)
+        self._write(
+            lambda: self.repository.persist_and_publish(key, value, json_encoder_cls, channel, data),
+            lambda: {
+                "operation": "persist_and_publish",
+                "key": key,
+                **self._entry_data(value, json_encoder_cls),
+                "channel": channel,
+                "message": data,
+            })
+
+
+def repository_from_config(config: Dict, asynchronous: bool = False) -> Union[Repository, AsyncRepository]:
+    """Instantiate the repository described in config.
+
+    :repository-backend is "redis" (default) or "sqlite" (database file given
+    by :sqlite-path). If asynchronous is True, an AsyncRepository is returned.
+    """
+    serializer = get_serializer(config.get(K("redis-serializer"), "json"))
+    backend = config.get(K("repository-backend"), "redis")
+    if backend == "redis":
+        repository_cls = AsyncRedisRepository if asynchronous else RedisRepository
+        return repository_cls(hash_layout=config.get(K("redis-hash-layout"), False), serializer=serializer)
+    if backend == "sqlite":
+        repository_cls = AsyncSQLiteRepository if asynchronous else SQLiteRepository
+        return repository_cls(config.get(K("sqlite-path"), "sunflower.sqlite3"), serializer=serializer)
+    raise ValueError(f"Unknown repository backend {backend!r}.")
@@ -0,0 +1,85 @@
+# This file is part of sunflower package. radio
+# This module contains ready-to-serve bodies of API responses, written by the scheduler.
+import gzip
+import json
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Type
+
+from sunflower.core.config import K
+from sunflower.core.persistence import MetadataEncoder
+from sunflower.core.persistence import PersistenceMixin
+
+
+def response_key(name: str, compressed: bool = False) -> str:
+    """Return key (relative to a channel) of a response body, or of its gzip-compressed version."""
+    return f"response:{name}:gzip" if compressed else f"response:{name}"
+
+
+def render_json(content: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = MetadataEncoder) -> bytes:
+    """Render content like JSONResponse of the API does."""
+    return json.dumps(
+        content, cls=json_encoder_cls, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class ResponseBodies:
+    """Write bodies of API responses of a channel when its data changes.
+
+    The server sends these bytes as is instead of encoding data at each
+    request (see server module): the body of /channels/<id> ("detail"), its
+    entry in /channels/ ("entry", the server joins entries of all channels)
+    and the body of /channels/<id>/schedule ("schedule"). Bodies are stored in
+    sunflower:channel:<id>:response:<name>, with a gzip-compressed version in
+    sunflower:channel:<id>:response:<name>:gzip if compress is True.
+
+    URLs in bodies start with api_url (the public URL of the API, ending with /).
+    """
+
+    def __init__(self, api_url: str, icecast_server_url: str, compress: bool = False):
+        self.api_url = api_url
+        self.icecast_server_url = icecast_server_url
+        self.compress = compress
+
+    @classmethod
+    def fromconfig(cls, config: Dict) -> Optional["ResponseBodies"]:
+        """Return ResponseBodies if :api-url is in config, else None (bodies are not written)."""
+        if K("api-url") not in config:
+            return None
+        return cls(config[K("api-url")], config[K("icecast-server-url")], config.get(K("compress-responses"), False))
+
+    def persist(self, obj: PersistenceMixin, name: str, content: Any):
+        """Render content and persist the body (and its compressed version) in obj keys."""
+        body = render_json(content)
+        obj.persist_to_repository(response_key(name), body)
+        if self.compress:
+            # mtime=0: same content, same bytes (and same ETag)
+            obj.persist_to_repository(response_key(name, compressed=True), gzip.compress(body, mtime=0))
+
+    def persist_channel(self, channel: PersistenceMixin, current_step: Optional[Dict], next_step: Optional[Dict]):
+        """Persist detail and entry bodies of channel, with given current and next steps data."""
+        channel_url = f"{self.api_url}channels/{channel.id}"
+        audio_stream = self.icecast_server_url + channel.id
+        self.persist(channel, "detail", {
+            "endpoint": channel.id,
+            "name": channel.id.capitalize(),
+            "audio_stream": audio_stream,
+            "current_step": current_step,
+            "next_step": next_step,
+            "schedule": f"{channel_url}/schedule",
+        })
+        self.persist(channel, "entry", {
+            "id": channel.id,
+            "name": channel.id.capitalize(),
+            "url": channel_url,
+            "schedule_url": f"{channel_url}/schedule",
+            "current_step": current_step,
+            "next_step": next_step,
+            "audio_stream": audio_stream,
+        })
+
+    def persist_schedule(self, channel: PersistenceMixin, schedule: List[Dict]):
+        """Persist schedule body of channel, with given schedule data."""
+        self.persist(channel, "schedule", schedule)
@@ -6,6 +6,7 @@ from datetime import datetime
 from time import sleep
 from typing import Any
 from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Set
 from typing import Union
@@ -15,7 +16,7 @@ from sunflower.core.stations import Station
 
 
 class Scheduler:
-    def __init__(self, channels, logger):
+    def __init__(self, channels, logger, publishers: Iterable[Any] = ()):
         self.channels: List[Channel] = channels
         self.logger = logger
         # get stations
@@ -29,6 +30,8 @@ class Scheduler:
         objects_to_process.extend([station for station in self.stations if hasattr(station, "process")])
         # add channels to objects to process
         objects_to_process.extend(self.channels)
+        # add publishers (objects with process() method publishing data of the scheduler, like metrics)
+        objects_to_process.extend(publishers)
         self.objects_to_process = objects_to_process
 
     @property
@@ -64,8 +67,26 @@ class Scheduler:
             "now": now,
         }
 
+    def reconcile(self):
+        """Read liquidsoap state before first iteration.
+
+        After a scheduler restart, liquidsoap may already use the right stations
+        and inputs. Objects implementing reconcile_liquidsoap_state() read this
+        state so only needed commands are sent afterwards.
+        """
+        context = self.context
+        for obj in self.objects_to_process:
+            if not hasattr(obj, "reconcile_liquidsoap_state"):
+                continue
+            try:
+                obj.reconcile_liquidsoap_state(self.logger, **context)
+            except Exception as err:
+                self.logger.error("Une erreur est survenue pendant la lecture de l'état de liquidsoap: {}.".format(err))
+                self.logger.error(traceback.format_exc())
+
     def run(self):
         """Keep data for radio client up to date."""
+        self.reconcile()
         while True:
             sleep(4)
             context = self.context
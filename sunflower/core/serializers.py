@@ -0,0 +1,154 @@
+# This file is part of sunflower package. radio
+# This module contains serializers used by repositories.
+import json
+from abc import ABC
+from abc import abstractmethod
+from enum import Enum
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Type
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+# Values written by binary serializers start with this byte followed by a letter
+# identifying the format. It can't start a json document (nor an utf-8 string),
+# so untagged values are json written by JSONSerializer or older versions.
+FORMAT_TAG_PREFIX = b"\xff"
+
+# bytes values (like ready-to-serve response bodies) are stored as is after this tag,
+# whatever the serializer, and read back as bytes
+RAW_TAG = FORMAT_TAG_PREFIX + b"r"
+
+
+class Serializer(ABC):
+    """Convert values to bytes stored in a repository, and back.
+
+    json_encoder_cls and object_hook are the same parameters as in the json
+    module. Binary serializers call json_encoder_cls.default() for objects they
+    can't serialize, and apply object_hook to decoded dicts.
+    """
+    tag: bytes = b""
+
+    @abstractmethod
+    def dumps(self, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes, object_hook: Optional[Callable] = None) -> Any:
+        """Decode data without its format tag."""
+        ...
+
+
+class JSONSerializer(Serializer):
+    """Default serializer, values are stored as json without tag."""
+
+    def dumps(self, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None) -> bytes:
+        return json.dumps(value, cls=json_encoder_cls).encode()
+
+    def loads(self, data: bytes, object_hook: Optional[Callable] = None) -> Any:
+        return json.loads(data.decode(), object_hook=object_hook)
+
+
+def _default_function(json_encoder_cls: Optional[Type[json.JSONEncoder]]) -> Callable[[Any], Any]:
+    encoder = json_encoder_cls() if json_encoder_cls is not None else None
+
+    def default(obj):
+        if encoder is not None:
+            return encoder.default(obj)
+        if isinstance(obj, Enum):
+            return obj.value
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+    return default
+
+
+def _apply_object_hook(value: Any, object_hook: Callable) -> Any:
+    """Apply object_hook to all dicts of value, innermost first (like json.loads())."""
+    if isinstance(value, dict):
+        return object_hook({k: _apply_object_hook(v, object_hook) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_apply_object_hook(item, object_hook) for item in value]
+    return value
+
+
+class OrjsonSerializer(Serializer):
+    """Fast json serializer (needs orjson)."""
+    tag = FORMAT_TAG_PREFIX + b"o"
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("orjson must be installed to use OrjsonSerializer.")
+
+    def dumps(self, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None) -> bytes:
+        return self.tag + orjson.dumps(value, default=_default_function(json_encoder_cls))
+
+    def loads(self, data: bytes, object_hook: Optional[Callable] = None) -> Any:
+        value = orjson.loads(data)
+        return value if object_hook is None else _apply_object_hook(value, object_hook)
+
+
+class MsgpackSerializer(Serializer):
+    """Compact binary serializer (needs msgpack)."""
+    tag = FORMAT_TAG_PREFIX + b"m"
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("msgpack must be installed to use MsgpackSerializer.")
+
+    def dumps(self, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None) -> bytes:
+        return self.tag + msgpack.packb(value, default=_default_function(json_encoder_cls), use_bin_type=True)
+
+    def loads(self, data: bytes, object_hook: Optional[Callable] = None) -> Any:
+        return msgpack.unpackb(data, raw=False, object_hook=object_hook)
+
+
+SERIALIZERS: Dict[str, Type[Serializer]] = {
+    "json": JSONSerializer,
+    "orjson": OrjsonSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+_serializers_by_tag: Dict[bytes, Serializer] = {}
+
+
+def get_serializer(name: str) -> Serializer:
+    """Return serializer from its name in config ("json", "orjson" or "msgpack")."""
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown serializer {name!r}.") from None
+
+
+def dumps(serializer: Serializer, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None) -> bytes:
+    """Dump value with serializer, or tag it with RAW_TAG if it is bytes."""
+    if isinstance(value, bytes):
+        return RAW_TAG + value
+    return serializer.dumps(value, json_encoder_cls)
+
+
+def loads(data: bytes, object_hook: Optional[Callable] = None) -> Any:
+    """Decode data written by any serializer, thanks to its format tag."""
+    if not data.startswith(FORMAT_TAG_PREFIX):
+        return json.loads(data.decode(), object_hook=object_hook)
+    tag = data[:2]
+    if tag == RAW_TAG:
+        return data[2:]
+    serializer = _serializers_by_tag.get(tag)
+    if serializer is None:
+        for serializer_cls in SERIALIZERS.values():
+            if serializer_cls.tag == tag:
+                serializer = _serializers_by_tag[tag] = serializer_cls()
+                break
+        else:
+            raise ValueError(f"Unknown serialization format tag {tag!r}.")
+    return serializer.loads(data[2:], object_hook)
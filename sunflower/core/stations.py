@@ -17,7 +17,9 @@ from sunflower.core.custom_types import Step
 from sunflower.core.custom_types import StreamMetadata
 from sunflower.core.custom_types import UpdateInfo
 from sunflower.core.decorators import classproperty
+from sunflower.core.liquidsoap import generate_liquidsoap_config_for_station
 from sunflower.core.liquidsoap import liquidsoap_telnet_session
+from sunflower.core.liquidsoap import send_command
 from sunflower.core.persistence import PersistenceMixin
 
 if TYPE_CHECKING:
@@ -25,6 +27,9 @@ if TYPE_CHECKING:
 
 REVERSE_STATIONS = {} # type: Dict[str, Type[DynamicStation]]
 
+# statuses of a started input.http source in liquidsoap
+STARTED_INPUT_STATUSES = ("connected", "connecting", "polling")
+
 
 class Station(ABC):
     """Base station.
@@ -135,18 +140,33 @@ class URLStation(Station, ABC):
 
     def start_liquidsoap_source(self):
         with liquidsoap_telnet_session() as session:
-            session.write(f"{self.formatted_station_name}.start\n".encode())
+            send_command(session, f"{self.formatted_station_name}.start")
+        self._is_onair = True
 
     def stop_liquidsoap_source(self):
         with liquidsoap_telnet_session() as session:
-            session.write(f"{self.formatted_station_name}.stop\n".encode())
+            send_command(session, f"{self.formatted_station_name}.stop")
+        self._is_onair = False
+
+    @classmethod
+    def get_liquidsoap_config(cls):
+        return generate_liquidsoap_config_for_station(cls)
+
+    def get_liquidsoap_source_status(self) -> str:
+        """Return status of input in liquidsoap ("stopped", "connected <url>"...)."""
+        with liquidsoap_telnet_session() as session:
+            return send_command(session, f"{self.formatted_station_name}.status")
+
+    def reconcile_liquidsoap_state(self, logger, **kwargs):
+        """Read if input is already started in liquidsoap, so process() does not restart it."""
+        status = self.get_liquidsoap_source_status()
+        self._is_onair = status.startswith(STARTED_INPUT_STATUSES)
+        logger.debug(f"station={self.formatted_station_name} Liquidsoap input status: {status!r}.")
 
     def process(self, logger, channels_using, channels_using_next, **kwargs):
         if any(channels_using_next[self]) or any(channels_using[self]):
             if not self._is_onair:
                 self.start_liquidsoap_source()
-                self._is_onair = True
         else:
             if self._is_onair:
                 self.stop_liquidsoap_source()
-                self._is_onair = False
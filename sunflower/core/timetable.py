@@ -77,6 +77,18 @@ class Timetable:
     def stations(self):
         return self._stations
 
+    def weekdays_slots(self) -> List[Tuple[Tuple[int, ...], Tuple[TimetableSlot, ...]]]:
+        """Return (weekdays, slots) tuples, weekdays sharing the same slots being grouped."""
+        grouped: List[Tuple[Tuple[int, ...], Tuple[TimetableSlot, ...]]] = []
+        for weekday, slots in enumerate(self._timetables):
+            for i, (weekdays, group_slots) in enumerate(grouped):
+                if group_slots == slots:
+                    grouped[i] = (weekdays + (weekday,), group_slots)
+                    break
+            else:
+                grouped.append(((weekday,), slots))
+        return grouped
+
     def resolved_timetable_of(self, dt: datetime) -> List[ResolvedTimetableSlot]:
         """Return a list of ResolvedTimetableSlot objects for the provided dt"""
         return [
@@ -8,8 +8,12 @@ import traceback
 if __name__ == "__main__":
     sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from sunflower.core.config import K
+from sunflower.core.config import get_config
+from sunflower.core.publishers import MetricsPublisher
 from sunflower.core.scheduler import Scheduler
 from sunflower.channels import channels
+from sunflower.channels import repository
 
 
 def launch_scheduler():
@@ -28,7 +32,8 @@ def launch_scheduler():
 
     logger.info("Starting scheduler.")
     try:
-        scheduler = Scheduler(channels, logger)
+        publishers = [MetricsPublisher(repository, interval=get_config().get(K("metrics-interval"), 60))]
+        scheduler = Scheduler(channels, logger, publishers)
         logger.info("Scheduler instantiated.")
         scheduler.run()
     except Exception as err:
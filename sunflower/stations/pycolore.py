@@ -1,3 +1,4 @@
+import hashlib
 import random
 from datetime import datetime
 from datetime import timedelta
@@ -18,33 +19,80 @@ from sunflower.core.custom_types import StreamMetadata
 from sunflower.core.custom_types import UpdateInfo
 from sunflower.core.liquidsoap import liquidsoap_telnet_session
 from sunflower.core.persistence import PersistentAttribute
+from sunflower.core.responses import render_json
 from sunflower.core.stations import DynamicStation
 from sunflower.utils.music import fetch_cover_and_link_on_deezer
+from sunflower.utils.music import group_by_artist
 from sunflower.utils.music import parse_songs
 from sunflower.utils.music import prevent_consecutive_artists
+from sunflower.utils.search import SearchIndex
+
+
+# number of songs (or artists) in each chunk of playlist views
+PLAYLIST_CHUNK_SIZE = 500
+# part of the version of playlist views, to be changed when views change (they are written again)
+PLAYLIST_VIEWS_FORMAT = b"2"
 
 
 class PycolorePlaylistStation(DynamicStation):
     station_thumbnail = "https://www.pycolore.fr/assets/img/sunflower-dark-min.jpg"
     name = "Radio Pycolore"
     id = "pycolore"
-    public_playlist = PersistentAttribute("playlist")
+    public_playlist = PersistentAttribute("playlist", notify_change=True)
+    playlist_views = PersistentAttribute("playlist:views", "Version and numbers of chunks of playlist views")
 
     @public_playlist.pre_set_hook
     def public_playlist(self, songs: List[Song]):
-        """Persist public fields of song objects in current playlist in redis."""
-        return [
+        """Persist public fields of song objects in current playlist in redis.
+
+        Chunks of playlist views are written before (see _persist_playlist_views()).
+        """
+        songs_data = [
             {"artist": song.artist, "title": song.title, "album": song.album}
             for song in songs]
+        self._persist_playlist_views(songs_data)
+        return songs_data
 
     def __init__(self, repository):
         super().__init__(repository, self.id)
+        self._playlist_version: Optional[str] = None
         self._songs_to_play: List[Song] = []
         # self._populate_songs_to_play()
         self._current_song: Optional[Song] = None
         self._current_song_end: float = 0
         self._end_of_use: datetime = datetime.now()
 
+    def _persist_playlist_views(self, songs_data: List[Dict]):
+        """Precompute views of the playlist served by the API, if the playlist changed.
+
+        Views are "flat" (list of songs) and "groupartist" (songs by artist).
+        Each one is split in chunks of PLAYLIST_CHUNK_SIZE songs or artists,
+        persisted as ready-to-serve json in playlist:<view>:<index> without
+        enclosing brackets, so the server joins them as they are. Then
+        playlist:views is set to {"version": ..., "flat": <number of chunks>,
+        "groupartist": <number of chunks>}.
+
+        The search index of the playlist is written in playlist:search
+        (see SearchIndex).
+        """
+        version = hashlib.sha1(PLAYLIST_VIEWS_FORMAT + render_json(songs_data)).hexdigest()[:12]
+        if self._playlist_version is None:
+            # views may have been written before a restart of the scheduler
+            self._playlist_version = (self.playlist_views or {}).get("version")
+        if version == self._playlist_version:
+            return
+        views = {"flat": songs_data, "groupartist": list(group_by_artist(songs_data).items())}
+        chunks_counts = {}
+        for view, items in views.items():
+            chunks = [items[i:i + PLAYLIST_CHUNK_SIZE] for i in range(0, len(items), PLAYLIST_CHUNK_SIZE)]
+            for index, chunk in enumerate(chunks):
+                body = render_json(chunk if view == "flat" else dict(chunk))
+                self.persist_to_repository(f"playlist:{view}:{index}", body[1:-1])
+            chunks_counts[view] = len(chunks)
+        self.persist_to_repository("playlist:search", SearchIndex.build(songs_data).to_data())
+        self.playlist_views = {"version": version, **chunks_counts}
+        self._playlist_version = version
+
     def _populate_songs_to_play(self):
         new_songs = parse_songs(get_config()[K("backup-songs-glob-pattern")])
         self.public_playlist = new_songs
@@ -0,0 +1,293 @@
+"""Fake liquidsoap telnet server for tests and benchmarks.
+
+FakeLiquidsoapServer speaks the subset of the liquidsoap telnet protocol
+used by sunflower:
+
+- `var.set <name> = <value>`, `var.get <name>` and `var.list` for variables
+  declared with `interactive.bool` and `interactive.string`;
+- `<input>.start`, `<input>.stop` and `<input>.status` for `input.http` sources;
+- `<queue>.push <uri>`, `<queue>.queue` and `<queue>.skip` for `request.queue`
+  sources, with simulated track durations.
+
+Every answer is followed by an `END` line, like liquidsoap does. Received
+commands are recorded so that tests can assert on exact command sequences,
+and latency and failures can be injected for benchmarks.
+"""
+import random
+import socketserver
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sunflower.core.channel import Channel
+
+
+class QueuedRequest(NamedTuple):
+    rid: int
+    uri: str
+    start: float
+    end: float
+
+
+class _RequestQueue:
+    """Simulated request.queue: pushed tracks are played one after the other."""
+
+    def __init__(self, clock: Callable[[], float]):
+        self._clock = clock
+        self.requests: List[QueuedRequest] = []
+
+    def push(self, rid: int, uri: str, duration: float):
+        now = self._clock()
+        start = max([now] + [request.end for request in self.requests])
+        self.requests.append(QueuedRequest(rid, uri, start, start + duration))
+
+    def pending(self) -> List[QueuedRequest]:
+        now = self._clock()
+        self.requests = [request for request in self.requests if request.end > now]
+        return self.requests
+
+    def skip(self):
+        pending = self.pending()
+        if not pending:
+            return
+        shift = pending[0].end - self._clock()
+        self.requests = [
+            request._replace(start=request.start - shift, end=request.end - shift)
+            for request in pending[1:]]
+
+
+class _LiquidsoapHandler(socketserver.StreamRequestHandler):
+    server: "_TCPServer"
+
+    def handle(self):
+        fake = self.server.fake
+        fake._record_connection()
+        for raw_line in self.rfile:
+            command = raw_line.decode().strip()
+            if not command:
+                continue
+            fake._record_command(command)
+            if fake.latency:
+                time.sleep(fake.latency)
+            if fake._should_fail(command):
+                if fake.failure == "disconnect":
+                    return
+                self._reply("ERROR: injected failure")
+                continue
+            if command in ("exit", "quit"):
+                self.wfile.write(b"Bye!\r\n")
+                return
+            self._reply(fake.execute(command))
+
+    def _reply(self, answer: str):
+        self.wfile.write(f"{answer}\r\nEND\r\n".encode())
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fake: "FakeLiquidsoapServer"):
+        self.fake = fake
+        super().__init__(address, _LiquidsoapHandler)
+
+
+class FakeLiquidsoapServer:
+    """Lightweight stand-in for the liquidsoap telnet server.
+
+    Parameters:
+    - bools: interactive.bool variables with their initial values
+    - strings: interactive.string variables with their initial values
+    - inputs: input.http sources with their url (all inputs are initially stopped)
+    - queues: request.queue ids
+    - durations: callable returning the simulated duration in seconds of a pushed uri
+    - latency: seconds to wait before answering each command
+    - failure_rate: probability for a command to fail
+    - failing_commands: command prefixes that always fail
+    - failure: "error" for answering an error, "disconnect" for closing the connection
+    - clock: time source for simulated tracks (time.monotonic by default)
+
+    Usage:
+
+    ```
+    with FakeLiquidsoapServer(bools={"fip_on_musique": False}) as server:
+        host, port = server.address
+        ...
+        assert server.commands == ["var.set fip_on_musique = true"]
+    ```
+    """
+
+    def __init__(self,
+                 bools: Optional[Dict[str, bool]] = None,
+                 strings: Optional[Dict[str, str]] = None,
+                 inputs: Optional[Dict[str, str]] = None,
+                 queues: Iterable[str] = (),
+                 durations: Callable[[str], float] = lambda uri: 180.0,
+                 latency: float = 0.0,
+                 failure_rate: float = 0.0,
+                 failing_commands: Iterable[str] = (),
+                 failure: str = "error",
+                 clock: Callable[[], float] = time.monotonic,
+                 seed: Optional[int] = None,
+                 host: str = "localhost",
+                 port: int = 0):
+        if failure not in ("error", "disconnect"):
+            raise ValueError("failure must be 'error' or 'disconnect'.")
+        self.bools: Dict[str, bool] = dict(bools or {})
+        self.strings: Dict[str, str] = dict(strings or {})
+        self.inputs: Dict[str, str] = dict(inputs or {})
+        self.started_inputs = set()
+        self.queues: Dict[str, _RequestQueue] = {queue_id: _RequestQueue(clock) for queue_id in queues}
+        self.durations = durations
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failing_commands = tuple(failing_commands)
+        self.failure = failure
+        self.commands: List[str] = []
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._next_rid = 0
+        self._lock = threading.RLock()
+        self._server = _TCPServer((host, port), self)
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def for_channels(cls, channels: Iterable["Channel"], **kwargs) -> "FakeLiquidsoapServer":
+        """Declare the variables, inputs and queues generated for given channels."""
+        bools, strings, inputs, queues = {}, {}, {}, []
+        for channel in channels:
+            for station in channel.stations:
+                station_name = station.formatted_station_name
+                if not channel.liquidsoap_timetable:
+                    bools[f"{station_name}_on_{channel.id}"] = False
+                if hasattr(station, "station_url"):
+                    inputs[station_name] = station.station_url
+                elif station_name not in queues:
+                    queues.append(station_name)
+            for field in ("title", "artist", "album"):
+                strings[f"{channel.id}_{field}"] = ""
+            queues.append(f"{channel.id}_custom_songs")
+        return cls(bools=bools, strings=strings, inputs=inputs, queues=queues, **kwargs)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def clear(self):
+        """Forget recorded commands and connections."""
+        with self._lock:
+            self.commands.clear()
+            self.connections = 0
+
+    def now_playing(self, queue_id: str) -> Optional[QueuedRequest]:
+        """Return the request currently played by given queue, if any."""
+        with self._lock:
+            pending = self.queues[queue_id].pending()
+            return pending[0] if pending else None
+
+    def _record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _record_command(self, command: str):
+        with self._lock:
+            self.commands.append(command)
+
+    def _should_fail(self, command: str) -> bool:
+        if self.failing_commands and command.startswith(self.failing_commands):
+            return True
+        with self._lock:
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def execute(self, command: str) -> str:
+        """Return the answer of liquidsoap to given command."""
+        with self._lock:
+            if command.startswith("var."):
+                return self._execute_var(command)
+            name, _, argument = command.partition(" ")
+            source, _, action = name.rpartition(".")
+            if source in self.inputs and action in ("start", "stop", "status", "url"):
+                return self._execute_input(source, action)
+            if source in self.queues and action in ("push", "queue", "skip"):
+                return self._execute_queue(source, action, argument)
+            return 'ERROR: unknown command, type "help" to get a list of commands.'
+
+    def _execute_var(self, command: str) -> str:
+        if command == "var.list":
+            return "\n".join(
+                [f"{name} : bool" for name in sorted(self.bools)]
+                + [f"{name} : string" for name in sorted(self.strings)])
+        action, _, argument = command.partition(" ")
+        if action == "var.get":
+            name = argument.strip()
+            if name in self.bools:
+                return "true" if self.bools[name] else "false"
+            if name in self.strings:
+                return f'"{self.strings[name]}"'
+            return f"Variable {name} is not defined."
+        if action == "var.set":
+            name, _, value = (part.strip() for part in argument.partition("="))
+            if name in self.bools:
+                if value not in ("true", "false"):
+                    return "Syntax error or type mismatch."
+                old = "true" if self.bools[name] else "false"
+                self.bools[name] = value == "true"
+                return f"Variable {name} set (was {old})."
+            if name in self.strings:
+                if len(value) < 2 or not (value[0] == value[-1] == '"'):
+                    return "Syntax error or type mismatch."
+                old = self.strings[name]
+                self.strings[name] = value[1:-1]
+                return f'Variable {name} set (was "{old}").'
+            return f"Variable {name} is not defined."
+        return 'ERROR: unknown command, type "help" to get a list of commands.'
+
+    def _execute_input(self, source: str, action: str) -> str:
+        if action == "start":
+            self.started_inputs.add(source)
+            return "Done"
+        if action == "stop":
+            self.started_inputs.discard(source)
+            return "Done"
+        if action == "url":
+            return self.inputs[source]
+        if source in self.started_inputs:
+            return f"connected {self.inputs[source]}"
+        return "stopped"
+
+    def _execute_queue(self, queue_id: str, action: str, argument: str) -> str:
+        queue = self.queues[queue_id]
+        if action == "push":
+            rid = self._next_rid
+            self._next_rid += 1
+            queue.push(rid, argument, self.durations(argument))
+            return str(rid)
+        if action == "queue":
+            return " ".join(str(request.rid) for request in queue.pending())
+        queue.skip()
+        return "Done"
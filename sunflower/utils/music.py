@@ -41,6 +41,17 @@ def prevent_consecutive_artists(songs_list: List[Song]) -> List[Song]:
     return songs
 
 
+def group_by_artist(songs_data: List[Dict[str, str]]) -> Dict[str, List[Dict[str, str]]]:
+    """Group public songs data by artist, keeping order of songs.
+
+    Return a dict artist -> list of {"title": ..., "album": ...}.
+    """
+    songs_by_artist: Dict[str, List[Dict[str, str]]] = {}
+    for song in songs_data:
+        songs_by_artist.setdefault(song["artist"], []).append({"title": song["title"], "album": song["album"]})
+    return songs_by_artist
+
+
 def parse_songs(glob_pattern: str) -> List[Song]:
     """Parse songs matching glob_pattern and return a list of Song objects.
     
@@ -0,0 +1,115 @@
+"""Search index over songs of a library."""
+
+import heapq
+import itertools
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+SEARCHED_FIELDS = ("artist", "title", "album")
+# positions of prefixes matching at least this number of tokens are merged once and kept,
+# for the MERGED_PREFIXES_CACHE_SIZE most recently searched prefixes
+MERGED_PREFIX_MIN_TOKENS = 64
+MERGED_PREFIXES_CACHE_SIZE = 32
+
+
+def normalize(text: str) -> str:
+    """Return lower-cased text without accents ("Éléphant" becomes "elephant")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """Return normalized words of text."""
+    return re.findall(r"\w+", normalize(text))
+
+
+class SearchIndex:
+    """Inverted index of normalized words of artist, album and title of songs.
+
+    Each word of a query matches the songs having a word starting with it, so
+    incomplete queries work for autocompletion. Results are in the order of
+    songs.
+
+    tokens is the sorted list of words, postings[i] the sorted list of
+    positions of songs containing tokens[i] and texts[position] the
+    normalized words of a song (starting with a space), used to check words of
+    the query other than the most selective one.
+    """
+
+    def __init__(self, songs: List[Dict[str, str]], tokens: List[str], postings: List[List[int]], texts: List[str]):
+        self.songs = songs
+        self.tokens = tokens
+        self.postings = postings
+        self.texts = texts
+        # number of positions in postings[:i] is offsets[i]
+        self.offsets = [0, *itertools.accumulate(len(positions) for positions in postings)]
+        self._merged_positions = lru_cache(maxsize=MERGED_PREFIXES_CACHE_SIZE)(self._merge_all)
+
+    @classmethod
+    def build(cls, songs: List[Dict[str, str]]) -> "SearchIndex":
+        postings_by_token: Dict[str, List[int]] = {}
+        texts = []
+        for position, song in enumerate(songs):
+            words = tokenize(" ".join(song.get(field, "") for field in SEARCHED_FIELDS))
+            texts.append(" " + " ".join(words))
+            for word in dict.fromkeys(words):
+                postings_by_token.setdefault(word, []).append(position)
+        tokens = sorted(postings_by_token)
+        return cls(songs, tokens, [postings_by_token[token] for token in tokens], texts)
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "SearchIndex":
+        return cls(data["songs"], data["tokens"], data["postings"], data["texts"])
+
+    def to_data(self) -> Dict[str, Any]:
+        """Return jsonable data of the index, to be persisted (see from_data())."""
+        return {"songs": self.songs, "tokens": self.tokens, "postings": self.postings, "texts": self.texts}
+
+    def _tokens_range(self, prefix: str) -> Tuple[int, int]:
+        return bisect_left(self.tokens, prefix), bisect_left(self.tokens, prefix + "\U0010ffff")
+
+    def _merge(self, start: int, end: int) -> Iterator[int]:
+        last_position = -1
+        for position in heapq.merge(*self.postings[start:end]):
+            if position != last_position:
+                yield position
+                last_position = position
+
+    def _merge_all(self, start: int, end: int) -> List[int]:
+        return sorted(set().union(*self.postings[start:end]))
+
+    def _positions(self, start: int, end: int) -> Iterable[int]:
+        """Return positions of songs of postings[start:end] once, in order.
+
+        Positions of short prefixes matching many tokens are merged once and
+        kept (in a bounded cache).
+        """
+        if end - start < MERGED_PREFIX_MIN_TOKENS:
+            return self._merge(start, end)
+        return self._merged_positions(start, end)
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """Return at most limit songs matching all words of query."""
+        words = tokenize(query)
+        if not words:
+            return []
+        ranges = {word: self._tokens_range(word) for word in words}
+        # iterate over songs of the word with the fewest positions, check other words on texts
+        selective_word = min(ranges, key=lambda word: self.offsets[ranges[word][1]] - self.offsets[ranges[word][0]])
+        other_words = [" " + word for word in ranges if word != selective_word]
+        results = []
+        for position in self._positions(*ranges[selective_word]):
+            text = self.texts[position]
+            if all(word in text for word in other_words):
+                results.append(self.songs[position])
+                if len(results) == limit:
+                    break
+        return results
@@ -21,7 +21,7 @@ class FakeRepository(Repository):
     def persist(self, key: str, value: Any, json_encoder_cls: Optional[Type[json.JSONEncoder]] = None):
         pass
 
-    def publish(self, key: str, channel, data):
+    def publish(self, channel, data):
         pass
 
 
@@ -0,0 +1,71 @@
+import asyncio
+
+from server.cache import CachedRepository
+from server.hub import UpdatesHub
+from sunflower.core.repository import AsyncSQLiteRepository
+from sunflower.core.repository import SQLiteRepository
+
+CURRENT_KEY = "sunflower:channel:tournesol:current"
+NEXT_KEY = "sunflower:channel:tournesol:next"
+UPDATES_CHANNEL = "sunflower:channel:tournesol:updates"
+
+
+def cached_repository(database, **kwargs) -> CachedRepository:
+    repository = AsyncSQLiteRepository(database)
+    return CachedRepository(repository, UpdatesHub(repository, [UPDATES_CHANNEL]), **kwargs)
+
+
+async def wait_for_hub(repository: CachedRepository):
+    while not repository.hub.connected:
+        await asyncio.sleep(0.01)
+
+
+def test_values_are_cached_until_updated(tmp_path):
+    database = str(tmp_path / "sunflower.sqlite3")
+    # the scheduler writes with its own repository
+    scheduler_repository = SQLiteRepository(database)
+    scheduler_repository.persist(CURRENT_KEY, "first")
+    scheduler_repository.persist(NEXT_KEY, "next")
+
+    async def main():
+        repository = cached_repository(database)
+        await repository.retrieve(CURRENT_KEY)
+        await wait_for_hub(repository)
+        assert await repository.retrieve_many([CURRENT_KEY, NEXT_KEY]) == ["first", "next"]
+        scheduler_repository.persist(CURRENT_KEY, "second")
+        assert await repository.retrieve(CURRENT_KEY) == "first"
+        scheduler_repository.publish(UPDATES_CHANNEL, 1)
+        for _ in range(100):
+            if await repository.retrieve(CURRENT_KEY) == "second":
+                break
+            await asyncio.sleep(0.01)
+        return await repository.retrieve_many([CURRENT_KEY, NEXT_KEY])
+
+    assert asyncio.run(main()) == ["second", "next"]
+
+
+def test_values_expire(tmp_path):
+    database = str(tmp_path / "sunflower.sqlite3")
+    scheduler_repository = SQLiteRepository(database)
+    scheduler_repository.persist(CURRENT_KEY, "first")
+
+    async def main():
+        repository = cached_repository(database, ttl=0.05)
+        await repository.retrieve(CURRENT_KEY)
+        await wait_for_hub(repository)
+        await repository.retrieve(CURRENT_KEY)
+        scheduler_repository.persist(CURRENT_KEY, "second")
+        await asyncio.sleep(0.1)
+        return await repository.retrieve(CURRENT_KEY)
+
+    assert asyncio.run(main()) == "second"
+
+
+def test_etag(tmp_path):
+    repository = cached_repository(str(tmp_path / "sunflower.sqlite3"))
+    value = {"start": 1, "end": 2}
+    etag = repository.etag([CURRENT_KEY, NEXT_KEY], [value, None])
+    assert etag.startswith('"') and etag.endswith('"')
+    assert repository.etag([CURRENT_KEY, NEXT_KEY], [dict(value), None]) == etag
+    assert repository.etag([CURRENT_KEY, NEXT_KEY], [{"start": 1, "end": 3}, None]) != etag
+    assert repository.etag([CURRENT_KEY], [value]) != etag
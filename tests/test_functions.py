@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+import pytest
+from sunflower.core.functions import BackgroundEventLoop
+from sunflower.core.functions import run_coroutine_synchronously
+
+
+async def add(a, b):
+    await asyncio.sleep(0)
+    return a + b
+
+
+async def current_loop():
+    return asyncio.get_running_loop()
+
+
+def test_background_loop_is_reused():
+    background_loop = BackgroundEventLoop()
+    assert background_loop.run(add, 1, b=2) == 3
+    assert background_loop.run(current_loop) is background_loop.run(current_loop) is background_loop.loop
+    assert threading.active_count() >= 2
+
+
+def test_background_loop_inside_running_loop():
+    async def main():
+        return run_coroutine_synchronously(add, 1, 2)
+
+    assert asyncio.run(main()) == 3
+
+
+def test_background_loop_rejects_functions():
+    with pytest.raises(TypeError):
+        BackgroundEventLoop().run(lambda: 1)
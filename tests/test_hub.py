@@ -0,0 +1,94 @@
+import asyncio
+
+from server.hub import HEARTBEAT
+from server.hub import OVERFLOW
+from server.hub import UpdatesHub
+from sunflower.core.repository import AsyncSQLiteRepository
+
+TOURNESOL_UPDATES = "sunflower:channel:tournesol:updates"
+MUSIQUE_UPDATES = "sunflower:channel:musique:updates"
+
+
+def test_messages_are_dispatched_to_clients(tmp_path):
+    repository = AsyncSQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    hub = UpdatesHub(repository, [TOURNESOL_UPDATES, MUSIQUE_UPDATES], heartbeat_interval=0.2)
+    notified_channels = []
+    hub.callbacks.append(notified_channels.append)
+
+    async def main():
+        with hub.client([TOURNESOL_UPDATES]) as tournesol_queue, \
+                hub.client([TOURNESOL_UPDATES, MUSIQUE_UPDATES]) as all_queue:
+            assert hub.clients_count == 2
+            while not hub.connected:
+                await asyncio.sleep(0.01)
+            await repository.publish(MUSIQUE_UPDATES, 1)
+            await repository.publish(TOURNESOL_UPDATES, 1)
+            all_messages = [await all_queue.get(), await all_queue.get()]
+            tournesol_message = await tournesol_queue.get()
+            # then both clients get a heartbeat
+            heartbeats = [await tournesol_queue.get(), await all_queue.get()]
+        assert hub.clients_count == 0
+        return all_messages, tournesol_message, heartbeats
+
+    all_messages, tournesol_message, heartbeats = asyncio.run(main())
+    assert all_messages == [("1", MUSIQUE_UPDATES, b"1"), ("2", TOURNESOL_UPDATES, b"1")]
+    assert tournesol_message == ("2", TOURNESOL_UPDATES, b"1")
+    assert heartbeats == [HEARTBEAT, HEARTBEAT]
+    # None when subscription started and stopped (with the event loop)
+    assert notified_channels == [None, MUSIQUE_UPDATES, TOURNESOL_UPDATES, None]
+
+
+def test_full_queues_overflow(tmp_path, caplog):
+    repository = AsyncSQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    hub = UpdatesHub(repository, [TOURNESOL_UPDATES], max_queue_size=2)
+
+    async def main():
+        with hub.client([TOURNESOL_UPDATES]) as queue:
+            while not hub.connected:
+                await asyncio.sleep(0.01)
+            for i in range(4):
+                await repository.publish(TOURNESOL_UPDATES, i)
+            await asyncio.sleep(0.3)
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    # dropped messages are replaced with OVERFLOW, and following ones are queued again
+    assert asyncio.run(main()) == [OVERFLOW, ("4", TOURNESOL_UPDATES, b"3")]
+    assert "Queue of a client is full (2 messages)" in caplog.text
+
+
+def test_replay(tmp_path):
+    repository = AsyncSQLiteRepository(str(tmp_path / "sunflower.sqlite3"), max_messages=3)
+    hub = UpdatesHub(repository, [TOURNESOL_UPDATES, MUSIQUE_UPDATES])
+
+    async def main():
+        for channel in (TOURNESOL_UPDATES, MUSIQUE_UPDATES, TOURNESOL_UPDATES, MUSIQUE_UPDATES):
+            await repository.publish(channel, 1)
+        return (
+            await hub.replay("2", [TOURNESOL_UPDATES]),
+            await hub.replay("3", [TOURNESOL_UPDATES, MUSIQUE_UPDATES]),
+            # message 2 was dropped from the log
+            await hub.replay("1", [TOURNESOL_UPDATES]),
+            await hub.replay("garbage", [TOURNESOL_UPDATES]),
+        )
+
+    assert asyncio.run(main()) == ([("3", TOURNESOL_UPDATES, b"1")], [("4", MUSIQUE_UPDATES, b"1")], None, None)
+
+
+def test_dynamic_subscriptions(tmp_path):
+    repository = AsyncSQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    hub = UpdatesHub(repository, [TOURNESOL_UPDATES, MUSIQUE_UPDATES])
+
+    async def main():
+        with hub.client() as queue:
+            while not hub.connected:
+                await asyncio.sleep(0.01)
+            hub.subscribe(queue, [TOURNESOL_UPDATES, "sunflower:channel:unknown:updates"])
+            await repository.publish(TOURNESOL_UPDATES, 1)
+            first_message = await queue.get()
+            hub.subscribe(queue, [MUSIQUE_UPDATES])
+            hub.unsubscribe(queue, [TOURNESOL_UPDATES])
+            await repository.publish(TOURNESOL_UPDATES, 1)
+            await repository.publish(MUSIQUE_UPDATES, 1)
+            return first_message, await queue.get()
+
+    assert asyncio.run(main()) == (("1", TOURNESOL_UPDATES, b"1"), ("3", MUSIQUE_UPDATES, b"1"))
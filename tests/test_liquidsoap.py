@@ -0,0 +1,299 @@
+import logging
+from datetime import datetime
+from telnetlib import Telnet
+
+import pytest
+from sunflower.core import liquidsoap
+from sunflower.core.channel import Channel
+from sunflower.core.config import K
+from sunflower.core.config import get_config
+from sunflower.core.custom_types import StreamMetadata
+from sunflower.core.liquidsoap import compile_timetable
+from sunflower.core.liquidsoap import generate_liquidsoap_config_for_channel
+from sunflower.core.liquidsoap import liquidsoap_telnet_session
+from sunflower.core.liquidsoap import render_liquidsoap_config
+from sunflower.core.liquidsoap import write_liquidsoap_config
+from sunflower.core.timetable import Timetable
+from sunflower.stations import FranceCulture
+from sunflower.stations import FranceInterParis
+from sunflower.utils.liquidsoap_server import FakeLiquidsoapServer
+from tests.common import FakeRepository
+
+logger = logging.getLogger("test")
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def send(session, command: str) -> str:
+    return liquidsoap.send_command(session, command)
+
+
+def use_server(monkeypatch, fake: FakeLiquidsoapServer):
+    host, port = fake.address
+    monkeypatch.setattr(liquidsoap, "get_config", lambda: {
+        K("liquidsoap-telnet-host"): host,
+        K("liquidsoap-telnet-port"): port})
+
+
+@pytest.fixture
+def server(monkeypatch):
+    clock = FakeClock()
+    with FakeLiquidsoapServer(
+            bools={"fip_on_musique": False},
+            strings={"musique_title": ""},
+            inputs={"fip": "http://fip.example/stream"},
+            queues=["pycolore"],
+            durations=lambda uri: 100.0,
+            clock=clock) as fake:
+        fake.clock = clock
+        use_server(monkeypatch, fake)
+        yield fake
+
+
+def test_variables(server):
+    with liquidsoap_telnet_session() as session:
+        assert send(session, "var.get fip_on_musique") == "false"
+        assert send(session, "var.set fip_on_musique = true") == "Variable fip_on_musique set (was false)."
+        assert send(session, "var.get fip_on_musique") == "true"
+        assert send(session, 'var.set musique_title = "Nuit"') == 'Variable musique_title set (was "").'
+        assert send(session, "var.get musique_title") == '"Nuit"'
+        assert send(session, "var.set unknown = true") == "Variable unknown is not defined."
+    assert server.commands == [
+        "var.get fip_on_musique",
+        "var.set fip_on_musique = true",
+        "var.get fip_on_musique",
+        'var.set musique_title = "Nuit"',
+        "var.get musique_title",
+        "var.set unknown = true"]
+    assert server.connections == 1
+
+
+def test_answers_containing_end(server):
+    with liquidsoap_telnet_session() as session:
+        assert send(session, 'var.set musique_title = "THE END"') == 'Variable musique_title set (was "").'
+        assert send(session, 'var.set musique_title = "WEEKEND"') == 'Variable musique_title set (was "THE END").'
+        assert send(session, "var.get musique_title") == '"WEEKEND"'
+        # following answers are not shifted
+        assert send(session, "var.get fip_on_musique") == "false"
+
+
+def test_inputs_and_queues(server):
+    with liquidsoap_telnet_session() as session:
+        assert send(session, "fip.status") == "stopped"
+        send(session, "fip.start")
+        assert send(session, "fip.status") == "connected http://fip.example/stream"
+        assert send(session, "pycolore.push /songs/a.opus") == "0"
+        assert send(session, "pycolore.push /songs/b.opus") == "1"
+        assert send(session, "pycolore.queue") == "0 1"
+    assert server.now_playing("pycolore").uri == "/songs/a.opus"
+    server.clock.time = 150
+    assert server.now_playing("pycolore").uri == "/songs/b.opus"
+    server.clock.time = 200
+    assert server.now_playing("pycolore") is None
+
+
+def test_failure_injection():
+    with FakeLiquidsoapServer(bools={"a": False}, failing_commands=["var.set"]) as server:
+        with Telnet(*server.address) as session:
+            assert send(session, "var.set a = true") == "ERROR: injected failure"
+            assert send(session, "var.get a") == "false"
+
+
+@pytest.fixture
+def channel():
+    france_culture = FranceCulture()
+    fip = FranceInterParis()
+    return Channel("musique", "Musique", FakeRepository(), Timetable({
+        (0, 1, 2, 3, 4, 5, 6): [
+            ("00:00", "12:00", france_culture),
+            ("12:00", "00:00", fip)]}))
+
+
+@pytest.fixture
+def channel_server(monkeypatch, channel):
+    with FakeLiquidsoapServer.for_channels([channel]) as fake:
+        use_server(monkeypatch, fake)
+        yield fake
+
+
+def test_reconcile_already_running_liquidsoap(channel, channel_server):
+    channel_server.bools["franceculture_on_musique"] = True
+    channel_server.started_inputs.add("franceculture")
+    france_culture = channel.station_at(datetime(2021, 1, 1, 8))
+    fip = channel.station_after(datetime(2021, 1, 1, 8))
+    context = {
+        "now": datetime(2021, 1, 1, 8),
+        "channels_using": {france_culture: [channel], fip: []},
+        "channels_using_next": {france_culture: [], fip: []}}
+
+    for station in (france_culture, fip):
+        station.reconcile_liquidsoap_state(logger, **context)
+    channel.reconcile_liquidsoap_state(logger, **context)
+    for station in (france_culture, fip):
+        station.process(logger, **context)
+
+    assert channel_server.commands == [
+        "franceculture.status",
+        "fip.status",
+        "var.get fip_on_musique",
+        "var.get franceculture_on_musique",
+        "var.get musique_artist",
+        "var.get musique_title",
+        "var.get musique_album"]
+    assert channel._liquidsoap_station == "franceculture"
+
+
+def test_reconcile_stale_liquidsoap_state(channel, channel_server):
+    channel_server.bools["fip_on_musique"] = True
+    channel.reconcile_liquidsoap_state(logger, datetime(2021, 1, 1, 8))
+
+    assert channel_server.commands == [
+        "var.get fip_on_musique",
+        "var.set fip_on_musique = false",
+        "var.get franceculture_on_musique",
+        "var.set franceculture_on_musique = true",
+        "var.get musique_artist",
+        "var.get musique_title",
+        "var.get musique_album"]
+    assert channel_server.bools == {"fip_on_musique": False, "franceculture_on_musique": True}
+
+
+def test_stream_metadata_only_sent_when_changed(channel, channel_server):
+    channel_server.strings["musique_artist"] = "France Culture"
+    channel.reconcile_liquidsoap_state(logger, datetime(2021, 1, 1, 8))
+    channel_server.clear()
+
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="La Grande Table", artist="France Culture"), logger)
+
+    # unchanged fields are only read
+    assert [command for command in channel_server.commands if not command.startswith("var.get")] == [
+        'var.set musique_title = "Les Matins"',
+        'var.set musique_title = "La Grande Table"']
+
+
+def test_stream_metadata_sent_again_after_liquidsoap_restart(channel, channel_server):
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    # liquidsoap is restarted, its variables are reset
+    channel_server.strings.update({"musique_artist": "", "musique_title": "", "musique_album": ""})
+    channel_server.clear()
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+
+    assert channel_server.commands == [
+        "var.get musique_artist",
+        'var.set musique_artist = "France Culture"',
+        "var.get musique_title",
+        'var.set musique_title = "Les Matins"',
+        "var.get musique_album"]
+
+
+def test_stream_metadata_not_acknowledged_without_liquidsoap(channel, monkeypatch):
+    monkeypatch.setattr(liquidsoap, "get_config", lambda: {
+        K("liquidsoap-telnet-host"): "localhost",
+        K("liquidsoap-telnet-port"): 1})
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    assert channel._stream_metadata is None
+
+
+def test_stream_metadata_sent_again_after_failure(channel, channel_server):
+    channel_server.failing_commands = ("var.set musique_title",)
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    channel_server.failing_commands = ()
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+
+    assert channel_server.commands == 2 * [
+        'var.set musique_artist = "France Culture"',
+        'var.set musique_title = "Les Matins"',
+        'var.set musique_album = ""']
+
+
+def test_stream_metadata_sent_again_to_undefined_variable(channel, channel_server):
+    del channel_server.strings["musique_album"]
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    channel.send_metadata_to_liquidsoap(StreamMetadata(title="Les Matins", artist="France Culture"), logger)
+    assert channel_server.commands == 2 * [
+        'var.set musique_artist = "France Culture"',
+        'var.set musique_title = "Les Matins"',
+        'var.set musique_album = ""']
+
+
+def test_compile_timetable():
+    france_culture = FranceCulture()
+    fip = FranceInterParis()
+    timetable = Timetable({
+        (0, 1, 3): [
+            ("00:00", "06:30", france_culture),
+            ("06:30", "00:00", fip)],
+        (2, 4, 5, 6): [
+            ("00:00", "01:00", fip),
+            ("01:00", "22:00", france_culture),
+            ("22:00", "01:00", fip)]})
+
+    assert compile_timetable(timetable) == [
+        ("{(1w-2w or 4w) and 0h-6h30m}", france_culture),
+        ("{(1w-2w or 4w) and 6h30m-0h}", fip),
+        ("{(3w or 5w-7w) and 0h-1h}", fip),
+        ("{(3w or 5w-7w) and 1h-22h}", france_culture),
+        ("{(3w or 5w-7w) and 22h-0h}", fip)]
+
+
+def test_compiled_switch_until_midnight(channel, monkeypatch):
+    monkeypatch.setattr(liquidsoap, "get_config", lambda: get_config("tests/fixtures/conf.edn"))
+    source_str, _ = generate_liquidsoap_config_for_channel(channel, compile_channel_timetable=True)
+    # liquidsoap intervals ending before their start wrap around midnight: 12h-0h lasts until midnight
+    assert source_str.startswith(
+        "# musique channel\n"
+        "musique_radio = switch(track_sensitive=false, [\n"
+        "    ({1w-7w and 0h-12h}, franceculture),\n"
+        "    ({1w-7w and 12h-0h}, fip),\n"
+        "])\n")
+
+
+def test_stopped_input_is_started(channel, channel_server):
+    fip = channel.station_after(datetime(2021, 1, 1, 8))
+    channel._verify_liquidsoap_station(fip, logger)
+    assert fip.is_onair
+    assert channel_server.commands == ["fip.status", "fip.start"]
+
+
+def test_reconcile_with_compiled_timetable(channel, monkeypatch):
+    channel.liquidsoap_timetable = True
+    with FakeLiquidsoapServer.for_channels([channel]) as fake:
+        use_server(monkeypatch, fake)
+        channel.reconcile_liquidsoap_state(logger, datetime(2021, 1, 1, 8))
+
+    assert fake.bools == {}
+    assert fake.commands == [
+        "var.get musique_artist",
+        "var.get musique_title",
+        "var.get musique_album"]
+    assert channel._liquidsoap_station == "franceculture"
+
+
+def test_write_config_only_if_changed(channel, monkeypatch, tmp_path):
+    monkeypatch.setattr(liquidsoap, "get_config", lambda: get_config("tests/fixtures/conf.edn"))
+    filename = str(tmp_path / "sunflower")
+
+    assert write_liquidsoap_config([channel], filename)
+    assert not write_liquidsoap_config([channel], filename)
+    channel.liquidsoap_timetable = True
+    assert write_liquidsoap_config([channel], filename)
+
+    with open(f"{filename}.liq") as f:
+        config_str = f.read()
+    assert config_str == render_liquidsoap_config([channel])
+    assert 'default = single("/tmp/default.ogg")' in config_str
+    assert 'host="localhost", port=8000, password="hackme"' in config_str
+    assert "({1w-7w and 0h-12h}, franceculture)" in config_str
+
+
+def test_render_config_without_channels(monkeypatch):
+    monkeypatch.setattr(liquidsoap, "get_config", lambda: get_config("tests/fixtures/conf.edn"))
+    assert 'default = single("/tmp/default.ogg")' in render_liquidsoap_config([])
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime
+from datetime import timedelta
+from logging import getLogger
+
+from server.metrics import Histogram
+from server.metrics import ServerMetrics
+from sunflower.core.metrics import RepositoryMetrics
+from sunflower.core.metrics import key_family
+from sunflower.core.publishers import MetricsPublisher
+from sunflower.core.repository import SQLiteRepository
+from sunflower.core.repository import update_id_time
+
+
+def test_key_family():
+    assert key_family("sunflower:channel:tournesol:current") == "channel:*:current"
+    assert key_family("sunflower:channel:musique:updates") == "channel:*:updates"
+    assert key_family("sunflower:station:pycolore:playlist") == "station:pycolore:playlist"
+
+
+def test_repository_metrics(tmp_path):
+    metrics = RepositoryMetrics()
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"), metrics=metrics)
+    repository.persist("sunflower:channel:tournesol:current", "abc")
+    repository.persist("sunflower:channel:musique:current", "abcdef")
+    repository.persist_and_publish("sunflower:channel:tournesol:next", {}, None, "sunflower:channel:tournesol:updates", 1)
+    repository.retrieve_many(["sunflower:channel:tournesol:current", "sunflower:station:pycolore:playlist"])
+
+    persist_stats = metrics.get("persist", "channel:*:current")
+    assert (persist_stats.calls, persist_stats.keys, persist_stats.bytes) == (2, 2, len('"abc""abcdef"'))
+    assert sum(persist_stats.latency_counts) == 2
+    assert metrics.get("persist_and_publish", "channel:*:updates").bytes == 1
+    assert metrics.get("retrieve_many", "channel:*:current").bytes == len('"abc"')
+    assert metrics.get("retrieve_many", "station:pycolore:playlist").keys == 1
+
+    snapshot = metrics.snapshot()
+    assert set(snapshot["families"]["channel:*:current"]) == {"persist", "retrieve_many"}
+    assert len(snapshot["families"]["channel:*:current"]["persist"]["latency_counts"]) == \
+        len(snapshot["latency_buckets"]) + 1
+    metrics.reset()
+    assert metrics.snapshot()["families"] == {}
+
+
+def test_metrics_publisher(tmp_path):
+    metrics = RepositoryMetrics()
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"), metrics=metrics)
+    publisher = MetricsPublisher(repository, metrics=metrics, interval=60)
+    now = datetime.now()
+    publisher.process(getLogger(), now)
+    first_snapshot = repository.retrieve("sunflower:metrics:scheduler:repository")
+    assert first_snapshot["families"] == {}
+    repository.retrieve("sunflower:channel:tournesol:current")
+    publisher.process(getLogger(), now + timedelta(seconds=30))
+    assert repository.retrieve("sunflower:metrics:scheduler:repository") == first_snapshot
+    publisher.process(getLogger(), now + timedelta(seconds=60))
+    assert "channel:*:current" in repository.retrieve("sunflower:metrics:scheduler:repository")["families"]
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1]
+    assert list(histogram.samples("lag", {"worker": "1"})) == [
+        'lag_bucket{worker="1",le="0.1"} 1',
+        'lag_bucket{worker="1",le="1"} 3',
+        'lag_bucket{worker="1",le="+Inf"} 4',
+        'lag_sum{worker="1"} 4.05',
+        'lag_count{worker="1"} 4',
+    ]
+
+
+def test_server_metrics(tmp_path):
+    repository_metrics = RepositoryMetrics()
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"), metrics=repository_metrics)
+    repository.persist("sunflower:channel:tournesol:current", {"start": 1})
+    metrics = ServerMetrics()
+    metrics.record_request("GET", "/channels/{channel_id}", 200, 0.002)
+    metrics.record_request("GET", "/channels/{channel_id}", 200, 0.02)
+    metrics.record_request("GET", "unmatched", 404, 0.001)
+    # sqlite update ids hold no timestamp
+    assert update_id_time("12") is None
+    metrics.record_update("12")
+    metrics.record_update(f"{int(datetime.now().timestamp() * 1000)}-0")
+    assert sum(metrics.update_lag.counts) == 1
+    worker = f'worker="{os.getpid()}"'
+    lines = metrics.render(repository_metrics, 3, True).splitlines()
+    assert f'sunflower_http_requests_total{{{worker},method="GET",route="/channels/{{channel_id}}",status="200"}} 2' in lines
+    assert f'sunflower_http_requests_total{{{worker},method="GET",route="unmatched",status="404"}} 1' in lines
+    assert (f'sunflower_http_request_duration_seconds_count{{{worker},method="GET",route="/channels/{{channel_id}}"}} 2'
+            in lines)
+    assert f"sunflower_updates_clients{{{worker}}} 3" in lines
+    assert f"sunflower_updates_connected{{{worker}}} 1" in lines
+    assert f"sunflower_update_lag_seconds_count{{{worker}}} 1" in lines
+    assert any(line.startswith("sunflower_repository_operation_seconds_count") and 'family="channel:*:current"' in line
+               for line in lines)
@@ -0,0 +1,64 @@
+import json
+import os
+
+from sunflower.core.publishers import NowPlaying
+from sunflower.core.publishers import SnapshotPublisher
+from sunflower.core.publishers import write_file_atomically
+from sunflower.core.repository import SQLiteRepository
+
+
+def test_write_file_atomically(tmp_path):
+    path = str(tmp_path / "index.json")
+    write_file_atomically(path, b"[]", 1600000000)
+    write_file_atomically(path, b"[1]", 1600000050)
+    with open(path, "rb") as f:
+        assert f.read() == b"[1]"
+    assert os.stat(path).st_mtime == 1600000050
+    assert os.listdir(tmp_path) == ["index.json"]
+
+
+def test_snapshot_publisher(tmp_path):
+    publisher = SnapshotPublisher(["tournesol", "musique"], str(tmp_path / "snapshots"))
+    publisher.update("musique", {"start": 1600000050, "end": 1600000200}, None)
+    publisher.update("tournesol", {"start": 1600000000, "end": 1600000100}, None)
+
+    tournesol_path = tmp_path / "snapshots" / "tournesol.json"
+    index_path = tmp_path / "snapshots" / "index.json"
+    assert json.loads(tournesol_path.read_text()) == {
+        "id": "tournesol", "current_step": {"start": 1600000000, "end": 1600000100}, "next_step": None}
+    assert [snapshot["id"] for snapshot in json.loads(index_path.read_text())] == ["tournesol", "musique"]
+    assert os.stat(tournesol_path).st_mtime == 1600000000
+    assert os.stat(index_path).st_mtime == 1600000050
+
+    # unchanged steps: files are not rewritten
+    os.utime(tournesol_path, (0, 0))
+    publisher.update("tournesol", {"start": 1600000000, "end": 1600000100}, None)
+    assert os.stat(tournesol_path).st_mtime == 0
+    publisher.update("tournesol", {"start": 1600000000, "end": 1600000100}, {"start": 1600000100, "end": 1600000200})
+    assert json.loads(tournesol_path.read_text())["next_step"] == {"start": 1600000100, "end": 1600000200}
+    assert os.stat(tournesol_path).st_mtime == 1600000000
+    assert sorted(os.listdir(tmp_path / "snapshots")) == ["index.json", "musique.json", "tournesol.json"]
+
+    # after a restart, the index keeps channels not updated yet
+    publisher = SnapshotPublisher(["tournesol", "musique"], str(tmp_path / "snapshots"))
+    publisher.update("tournesol", {"start": 1600000100, "end": 1600000200}, None)
+    assert [snapshot["id"] for snapshot in json.loads(index_path.read_text())] == ["tournesol", "musique"]
+    assert os.stat(index_path).st_mtime == 1600000100
+
+
+def test_now_playing(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    now_playing = NowPlaying(repository)
+    now_playing.update("tournesol", {"start": 1, "end": 2}, None)
+    now_playing.update("musique", {"start": 1, "end": 3}, {"start": 3, "end": 4})
+    now_playing.update("musique", {"start": 1, "end": 3}, {"start": 3, "end": 4})
+    assert repository.retrieve_many(
+        ["sunflower:now-playing:all:steps:tournesol", "sunflower:now-playing:all:steps:musique"]) == [
+        {"current_step": {"start": 1, "end": 2}, "next_step": None},
+        {"current_step": {"start": 1, "end": 3}, "next_step": {"start": 3, "end": 4}},
+    ]
+    # unchanged entry is not written again
+    assert len(repository.messages_since(0, ["sunflower:now-playing:all:updates"])) == 2
+    # after a restart of the scheduler, entries of other channels are kept
+    NowPlaying(repository).update("tournesol", {"start": 2, "end": 5}, None)
+    assert repository.retrieve("sunflower:now-playing:all:steps:musique") is not None
@@ -0,0 +1,257 @@
+import asyncio
+import multiprocessing
+import uuid
+
+import aredis
+import pytest
+from sunflower.core.config import K
+from sunflower.core.custom_types import BroadcastType
+from sunflower.core.persistence import MetadataEncoder
+from sunflower.core.repository import AsyncRedisRepository
+from sunflower.core.repository import AsyncSQLiteRepository
+from sunflower.core.repository import Repository
+from sunflower.core.repository import SQLiteRepository
+from sunflower.core.repository import WriteBehindRepository
+from sunflower.core.repository import update_id_time
+from sunflower.core.repository import repository_from_config
+from sunflower.core.serializers import OrjsonSerializer
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "sunflower.sqlite3")
+
+
+@pytest.fixture
+def redis_object():
+    """Yield prefix of keys of an object of the local redis server, deleted afterwards (skip without redis)."""
+    prefix = f"sunflower:test:{uuid.uuid4().hex}"
+
+    async def ping():
+        await AsyncRedisRepository().redis.ping()
+
+    try:
+        asyncio.run(ping())
+    except (aredis.ConnectionError, OSError):
+        pytest.skip("redis server is not available")
+    yield prefix
+
+    async def clean():
+        redis = AsyncRedisRepository().redis
+        keys = await redis.keys(f"{prefix}*")
+        if keys:
+            await redis.delete(*keys)
+
+    asyncio.run(clean())
+
+
+class IsolatedRedisRepository(AsyncRedisRepository):
+    update_log_key = "sunflower:test:updates"
+
+
+def test_sqlite_persist_and_retrieve(database):
+    repository = SQLiteRepository(database)
+    assert repository.retrieve("sunflower:channel:tournesol:current") is None
+    repository.persist("sunflower:channel:tournesol:current", {"type": BroadcastType.MUSIC}, MetadataEncoder)
+    repository.persist("sunflower:channel:tournesol:next", [1, 2])
+    assert repository.retrieve("sunflower:channel:tournesol:current") == {"type": "Track"}
+    # other connection, other serializer
+    other_repository = SQLiteRepository(database, serializer=OrjsonSerializer())
+    other_repository.persist("sunflower:channel:tournesol:next", [3])
+    assert repository.retrieve_many([
+        "sunflower:channel:tournesol:current",
+        "sunflower:channel:musique:current",
+        "sunflower:channel:tournesol:next",
+    ]) == [{"type": "Track"}, None, [3]]
+
+
+def publish_from_other_process(database):
+    SQLiteRepository(database).persist_and_publish(
+        "sunflower:channel:tournesol:current", {"title": "Le 6/9"}, None, "sunflower:channel:tournesol:updates", 1)
+
+
+def test_sqlite_updates_between_processes(database):
+    repository = AsyncSQLiteRepository(database)
+
+    async def main():
+        await repository.publish("sunflower:channel:tournesol:updates", "old message")
+        _, last_id = await repository.update_log_bounds()
+        assert await repository.read_updates(last_id, timeout=0.1) == []
+        process = multiprocessing.get_context("fork").Process(target=publish_from_other_process, args=(database,))
+        process.start()
+        updates = await repository.read_updates(last_id, timeout=5)
+        process.join()
+        return updates
+
+    [(_, channel, data)] = asyncio.run(main())
+    assert channel == "sunflower:channel:tournesol:updates"
+    assert data == b"1"
+    assert asyncio.run(repository.retrieve("sunflower:channel:tournesol:current")) == {"title": "Le 6/9"}
+
+
+def test_sqlite_keeps_last_messages(database):
+    repository = SQLiteRepository(database, max_messages=3)
+    for i in range(10):
+        repository.publish("sunflower:channel:tournesol:updates", i)
+    assert [data for _, _, data in repository.messages_since(0, ["sunflower:channel:tournesol:updates"])] == [
+        "7", "8", "9"]
+
+
+def test_repository_from_config(database):
+    config = {K("repository-backend"): "sqlite", K("sqlite-path"): database}
+    assert isinstance(repository_from_config(config), SQLiteRepository)
+    assert isinstance(repository_from_config(config, asynchronous=True), AsyncSQLiteRepository)
+    with pytest.raises(ValueError):
+        repository_from_config({K("repository-backend"): "memcached"})
+
+
+class FlakyRepository(Repository):
+    """In-memory repository raising ConnectionError while unavailable."""
+
+    def __init__(self):
+        self.available = True
+        self.values = {}
+        self.messages = []
+
+    def _check(self):
+        if not self.available:
+            raise ConnectionError("Repository unavailable")
+
+    def retrieve(self, key, object_hook=None):
+        self._check()
+        return self.values.get(key)
+
+    def persist(self, key, value, json_encoder_cls=None):
+        self._check()
+        self.values[key] = value
+
+    def publish(self, channel, data):
+        self._check()
+        self.messages.append((channel, data, dict(self.values)))
+
+
+def test_write_behind_during_outage(tmp_path):
+    flaky_repository = FlakyRepository()
+    repository = WriteBehindRepository(flaky_repository, path=str(tmp_path / "journal.jsonl"), retry_interval=0)
+    repository.persist("sunflower:channel:tournesol:schedule", [])
+    flaky_repository.available = False
+    repository.persist("sunflower:channel:tournesol:next", {"title": "Next"})
+    repository.persist_and_publish(
+        "sunflower:channel:tournesol:current", {"title": "First"}, None, "sunflower:channel:tournesol:updates", 1)
+    repository.persist_and_publish(
+        "sunflower:channel:tournesol:current", {"title": "Second"}, None, "sunflower:channel:tournesol:updates", 1)
+    assert len(repository) == 3
+    # own writes are readable, even those written before the outage, other keys are not
+    assert repository.retrieve("sunflower:channel:tournesol:current") == {"title": "Second"}
+    assert repository.retrieve("sunflower:channel:tournesol:schedule") == []
+    with pytest.raises(ConnectionError):
+        repository.retrieve("sunflower:channel:musique:schedule")
+    # journal survives a restart of the scheduler
+    restarted_repository = WriteBehindRepository(flaky_repository, path=str(tmp_path / "journal.jsonl"))
+    assert len(restarted_repository) == 3
+    flaky_repository.available = True
+    assert restarted_repository.flush(force=True)
+    assert flaky_repository.values == {
+        "sunflower:channel:tournesol:schedule": [],
+        "sunflower:channel:tournesol:next": {"title": "Next"},
+        "sunflower:channel:tournesol:current": {"title": "Second"},
+    }
+    # replayed in order: first message was published after next step was persisted
+    assert [data for _, data, _ in flaky_repository.messages] == [1, 1]
+    assert "sunflower:channel:tournesol:next" in flaky_repository.messages[0][2]
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+
+
+def test_write_behind_passes_writes_through():
+    flaky_repository = FlakyRepository()
+    repository = WriteBehindRepository(flaky_repository, retry_interval=0)
+    step = (1, 2)
+    repository.persist("sunflower:channel:tournesol:current", step, MetadataEncoder)
+    # the journal is empty: the value is not encoded before the wrapped repository gets it
+    assert flaky_repository.values["sunflower:channel:tournesol:current"] is step
+    assert len(repository) == 0
+    flaky_repository.values["sunflower:channel:tournesol:next"] = {"title": "Next"}
+    assert repository.retrieve("sunflower:channel:tournesol:next") == {"title": "Next"}
+    # during an outage, last values read or written are served
+    flaky_repository.available = False
+    assert repository.retrieve_many(["sunflower:channel:tournesol:current", "sunflower:channel:tournesol:next"]) == [
+        [1, 2], {"title": "Next"}]
+
+
+def test_write_behind_is_bounded():
+    flaky_repository = FlakyRepository()
+    flaky_repository.available = False
+    repository = WriteBehindRepository(flaky_repository, max_entries=2, retry_interval=0)
+    for i in range(4):
+        repository.publish("sunflower:channel:tournesol:updates", i)
+    assert len(repository) == 2
+    assert repository.dropped_entries == 2
+    flaky_repository.available = True
+    repository.retrieve("sunflower:channel:tournesol:current")
+    assert [data for _, data, _ in flaky_repository.messages] == [2, 3]
+
+
+def test_write_behind_journals_bytes(tmp_path):
+    flaky_repository = FlakyRepository()
+    flaky_repository.available = False
+    repository = WriteBehindRepository(flaky_repository, path=str(tmp_path / "journal.jsonl"), retry_interval=0)
+    repository.persist("sunflower:channel:tournesol:response:detail:gzip", b"\x1f\x8b\x08")
+    assert repository.retrieve("sunflower:channel:tournesol:response:detail:gzip") == b"\x1f\x8b\x08"
+    restarted_repository = WriteBehindRepository(flaky_repository, path=str(tmp_path / "journal.jsonl"))
+    flaky_repository.available = True
+    assert restarted_repository.flush(force=True)
+    assert flaky_repository.values == {"sunflower:channel:tournesol:response:detail:gzip": b"\x1f\x8b\x08"}
+
+
+def test_redis_string_layout(redis_object):
+    async def main():
+        repository = AsyncRedisRepository()
+        await repository.persist(f"{redis_object}:current", {"title": "Le 6/9"})
+        await repository.persist(f"{redis_object}:playlist:flat:0", b"{}")
+        assert await repository.redis.get(f"{redis_object}:current") == b'{"title": "Le 6/9"}'
+        return await repository.retrieve_many([
+            f"{redis_object}:current", f"{redis_object}:next", f"{redis_object}:playlist:flat:0"])
+
+    assert asyncio.run(main()) == [{"title": "Le 6/9"}, None, b"{}"]
+
+
+def test_redis_hash_layout(redis_object):
+    async def main():
+        legacy_repository = AsyncRedisRepository()
+        repository = AsyncRedisRepository(hash_layout=True)
+        # written with the string layout, before migration
+        await legacy_repository.persist(f"{redis_object}:playlist", [1, 2])
+        await legacy_repository.persist(f"{redis_object}:next", "legacy")
+        # nested keys are fields of the hash of the object, not of a hash at a string key
+        await repository.persist(f"{redis_object}:playlist", [3])
+        await repository.persist(f"{redis_object}:playlist:flat:0", b"{}")
+        await repository.persist_and_publish(f"{redis_object}:current", "current", None, f"{redis_object}:updates", 1)
+        assert set(await repository.redis.hkeys(redis_object)) == {
+            b"playlist", b"playlist:flat:0", b"current", b"version"}
+        assert await repository.retrieve(f"{redis_object}:playlist:flat") is None
+        assert await repository.retrieve(f"{redis_object}:playlist") == [3]
+        # missing fields are read from string keys
+        assert await repository.retrieve(f"{redis_object}:next") == "legacy"
+        assert await repository.retrieve(f"{redis_object}:version") == 3
+        return await repository.retrieve_many([
+            f"{redis_object}:current", f"{redis_object}:next", f"{redis_object}:missing",
+            f"{redis_object}:playlist:flat:0", f"{redis_object}:version"])
+
+    assert asyncio.run(main()) == ["current", "legacy", None, b"{}", 3]
+
+
+def test_redis_update_log(redis_object):
+    async def main():
+        repository = IsolatedRedisRepository()
+        await repository.redis.delete(repository.update_log_key)
+        assert await repository.update_log_bounds() == (None, None)
+        await repository.persist_and_publish(f"{redis_object}:current", "first", None, f"{redis_object}:updates", 1)
+        await repository.publish(f"{redis_object}:updates", {"step": 2})
+        first_id, last_id = await repository.update_log_bounds()
+        assert first_id != last_id and update_id_time(last_id) is not None
+        assert await repository.read_updates(first_id) == [(last_id, f"{redis_object}:updates", b'{"step": 2}')]
+        assert [update[0] for update in await repository.read_updates("0")] == [first_id, last_id]
+        assert await repository.read_updates(last_id, timeout=0.05) == []
+        await repository.redis.delete(repository.update_log_key)
+
+    asyncio.run(main())
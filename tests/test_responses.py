@@ -0,0 +1,56 @@
+import gzip
+import json
+
+from sunflower.core.config import K
+from sunflower.core.custom_types import BroadcastType
+from sunflower.core.persistence import PersistenceMixin
+from sunflower.core.repository import SQLiteRepository
+from sunflower.core.responses import ResponseBodies
+from sunflower.core.responses import render_json
+from sunflower.core.responses import response_key
+
+
+class FakeChannel(PersistenceMixin):
+    data_type = "channel"
+
+
+def test_render_json():
+    assert render_json({"title": "Éléphant", "type": BroadcastType.MUSIC}) == '{"title":"Éléphant","type":"Track"}'.encode()
+
+
+def test_fromconfig():
+    assert ResponseBodies.fromconfig({K("icecast-server-url"): "https://icecast.pycolore.fr/"}) is None
+    response_bodies = ResponseBodies.fromconfig({
+        K("api-url"): "https://api.radio.pycolore.fr/",
+        K("icecast-server-url"): "https://icecast.pycolore.fr/",
+        K("compress-responses"): True,
+    })
+    assert response_bodies.compress
+
+
+def test_channel_bodies(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    channel = FakeChannel(repository, "tournesol")
+    response_bodies = ResponseBodies("https://api.radio.pycolore.fr/", "https://icecast.pycolore.fr/", compress=True)
+    current_step = {"start": 1, "end": 2, "broadcast": {"title": "Le 6/9", "type": BroadcastType.PROGRAMME}}
+    response_bodies.persist_channel(channel, current_step, None)
+    response_bodies.persist_schedule(channel, [current_step])
+
+    detail, compressed_detail, entry, schedule, compressed_schedule = channel.retrieve_many_from_repository([
+        response_key("detail"), response_key("detail", compressed=True), response_key("entry"),
+        response_key("schedule"), response_key("schedule", compressed=True)])
+    assert json.loads(detail) == {
+        "endpoint": "tournesol",
+        "name": "Tournesol",
+        "audio_stream": "https://icecast.pycolore.fr/tournesol",
+        "current_step": {"start": 1, "end": 2, "broadcast": {"title": "Le 6/9", "type": "Programme"}},
+        "next_step": None,
+        "schedule": "https://api.radio.pycolore.fr/channels/tournesol/schedule",
+    }
+    assert gzip.decompress(compressed_detail) == detail
+    assert json.loads(entry)["url"] == "https://api.radio.pycolore.fr/channels/tournesol"
+    assert json.loads(schedule) == [json.loads(detail)["current_step"]]
+    assert gzip.decompress(compressed_schedule) == schedule
+    # same content, same bytes
+    response_bodies.persist_channel(channel, current_step, None)
+    assert channel.retrieve_from_repository(response_key("detail", compressed=True)) == compressed_detail
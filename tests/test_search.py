@@ -0,0 +1,50 @@
+from sunflower.utils.search import MERGED_PREFIXES_CACHE_SIZE
+from sunflower.utils.search import SearchIndex
+from sunflower.utils.search import normalize
+from sunflower.utils.search import tokenize
+
+SONGS = [
+    {"artist": "Édith Piaf", "title": "La Vie en rose", "album": "Chansons parisiennes"},
+    {"artist": "Daft Punk", "title": "One More Time", "album": "Discovery"},
+    {"artist": "Daft Punk", "title": "Digital Love", "album": "Discovery"},
+    {"artist": "Noir Désir", "title": "Le vent nous portera", "album": "Des visages des figures"},
+]
+
+
+def test_normalize():
+    assert normalize("Édith PIAF") == "edith piaf"
+    assert tokenize("Noir Désir - Le vent") == ["noir", "desir", "le", "vent"]
+
+
+def test_search():
+    index = SearchIndex.build(SONGS)
+    assert index.search("piaf") == [SONGS[0]]
+    assert index.search("EDITH") == [SONGS[0]]
+    # every word is a prefix, in any field
+    assert index.search("daft disc") == [SONGS[1], SONGS[2]]
+    assert index.search("daft dig") == [SONGS[2]]
+    assert index.search("desi") == [SONGS[3]]
+    assert index.search("d", limit=2) == [SONGS[1], SONGS[2]]
+    assert index.search("daft piaf") == []
+    assert index.search("  ") == []
+    assert SearchIndex.from_data(index.to_data()).search("vent") == [SONGS[3]]
+
+
+def test_search_many_tokens():
+    songs = [
+        {"artist": f"Artist {i % 500}", "title": f"Song {i} of the library", "album": f"Album {i % 1000}"}
+        for i in range(5000)]
+    index = SearchIndex.build(songs)
+    assert index.search("song 4999") == [songs[4999]]
+    assert index.search("artist 42 song 5", limit=3) == [songs[542], songs[1542], songs[2542]]
+    # prefixes matching many tokens are merged once
+    for query in ("1", "s", "song 1", "album 99"):
+        expected = [song for song in songs if all(
+            any(word.startswith(query_word) for word in tokenize(" ".join(song.values())))
+            for query_word in tokenize(query))][:20]
+        assert index.search(query) == expected
+    assert index._merged_positions.cache_info().hits == 1
+    # only the most recently searched ones are kept
+    for prefix in range(10, 50):
+        assert index.search(f"artist {prefix}")
+    assert index._merged_positions.cache_info().currsize == MERGED_PREFIXES_CACHE_SIZE
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from sunflower.core.custom_types import BroadcastType
+from sunflower.core.persistence import MetadataEncoder
+from sunflower.core.serializers import JSONSerializer
+from sunflower.core.serializers import MsgpackSerializer
+from sunflower.core.serializers import OrjsonSerializer
+from sunflower.core.serializers import dumps
+from sunflower.core.serializers import get_serializer
+from sunflower.core.serializers import loads
+
+VALUE = {"start": 1, "end": 2, "broadcast": {"type": BroadcastType.MUSIC, "title": "Éléphant"}, "songs": [1, 2.5]}
+DECODED_VALUE = {"start": 1, "end": 2, "broadcast": {"type": "Track", "title": "Éléphant"}, "songs": [1, 2.5]}
+
+
+def available_serializers():
+    serializers = [JSONSerializer()]
+    for serializer_cls in (OrjsonSerializer, MsgpackSerializer):
+        try:
+            serializers.append(serializer_cls())
+        except RuntimeError:
+            pass
+    return serializers
+
+
+@pytest.mark.parametrize("serializer", available_serializers(), ids=lambda serializer: type(serializer).__name__)
+def test_round_trip(serializer):
+    data = serializer.dumps(VALUE, MetadataEncoder)
+    assert data.startswith(serializer.tag)
+    assert loads(data) == DECODED_VALUE
+    assert loads(data, object_hook=lambda mapping: sorted(mapping)) == ["broadcast", "end", "songs", "start"]
+
+
+def test_untagged_values_are_json():
+    legacy_data = json.dumps(DECODED_VALUE).encode()
+    assert loads(legacy_data) == DECODED_VALUE
+    assert JSONSerializer().dumps(VALUE, MetadataEncoder) == json.dumps(VALUE, cls=MetadataEncoder).encode()
+
+
+@pytest.mark.parametrize("serializer", available_serializers(), ids=lambda serializer: type(serializer).__name__)
+def test_bytes_are_stored_as_is(serializer):
+    assert loads(dumps(serializer, b"\x1f\x8b compressed body")) == b"\x1f\x8b compressed body"
+    assert loads(dumps(serializer, VALUE, MetadataEncoder)) == DECODED_VALUE
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        loads(b"\xffz{}")
+    with pytest.raises(ValueError):
+        get_serializer("pickle")
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    serializer = get_serializer("msgpack")
+    assert isinstance(serializer, MsgpackSerializer)
+    step = {"start": 1600000000, "end": 1600000240, "broadcast": {
+        "title": "Nina Simone • Feeling Good", "type": BroadcastType.MUSIC, "metadata": None}}
+    data = dumps(serializer, step, MetadataEncoder)
+    assert data.startswith(serializer.tag)
+    # read back whatever the serializer of the reader
+    assert loads(data) == {"start": 1600000000, "end": 1600000240, "broadcast": {
+        "title": "Nina Simone • Feeling Good", "type": "Track", "metadata": None}}
+    assert loads(dumps(serializer, [b"\x00raw", "text"])) == [b"\x00raw", "text"]
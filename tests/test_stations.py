@@ -1 +1,43 @@
+import json
 
+from sunflower.core.custom_types import Song
+from sunflower.core.repository import SQLiteRepository
+from sunflower.stations import PycolorePlaylistStation
+from sunflower.stations import pycolore
+from sunflower.utils.search import SearchIndex
+
+SONGS = [
+    Song(path=f"/songs/{i}.opus", artist=artist, album="Album", title=f"Title {i}", length=180)
+    for i, artist in enumerate(["Alpha", "Alpha", "Bravo", "Charlie", "Charlie"])]
+
+
+def test_playlist_views(tmp_path, monkeypatch):
+    monkeypatch.setattr(pycolore, "PLAYLIST_CHUNK_SIZE", 2)
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    station = PycolorePlaylistStation(repository)
+    station.public_playlist = SONGS
+
+    views = repository.retrieve("sunflower:station:pycolore:playlist:views")
+    assert (views["flat"], views["groupartist"]) == (3, 2)
+    flat_chunks = repository.retrieve_many([f"sunflower:station:pycolore:playlist:flat:{i}" for i in range(3)])
+    assert json.loads(b"[" + b",".join(flat_chunks) + b"]") == repository.retrieve("sunflower:station:pycolore:playlist")
+    grouped_chunks = repository.retrieve_many([f"sunflower:station:pycolore:playlist:groupartist:{i}" for i in range(2)])
+    assert json.loads(b"{" + b",".join(grouped_chunks) + b"}") == {
+        "Alpha": [{"title": "Title 0", "album": "Album"}, {"title": "Title 1", "album": "Album"}],
+        "Bravo": [{"title": "Title 2", "album": "Album"}],
+        "Charlie": [{"title": "Title 3", "album": "Album"}, {"title": "Title 4", "album": "Album"}],
+    }
+
+    # views of the same playlist are not written again, even after a restart
+    repository.persist("sunflower:station:pycolore:playlist:flat:0", b"")
+    PycolorePlaylistStation(repository).public_playlist = SONGS
+    assert repository.retrieve("sunflower:station:pycolore:playlist:flat:0") == b""
+    PycolorePlaylistStation(repository).public_playlist = SONGS[:1]
+    assert repository.retrieve("sunflower:station:pycolore:playlist:views")["flat"] == 1
+
+
+def test_playlist_search_index(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / "sunflower.sqlite3"))
+    PycolorePlaylistStation(repository).public_playlist = SONGS
+    index = SearchIndex.from_data(repository.retrieve("sunflower:station:pycolore:playlist:search"))
+    assert [song["title"] for song in index.search("charlie")] == ["Title 3", "Title 4"]